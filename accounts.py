@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Account social salvati nella tabella account_settings
+Labirintoambientale.it
+
+Il dispatcher (outbox) legge gli account da una copia in memoria per
+processo, ricaricata solo quando cambia la versione in
+CACHE_DIR/accounts_version. La versione viene rigenerata dopo ogni commit che
+modifica AccountSettings: una modifica dalla pagina Impostazioni vale subito
+per tutti i worker gunicorn e per lo script cron, senza riavvii e senza una
+query per ogni pubblicazione.
+
+Le piattaforme senza riga in tabella usano i valori di Config.SOCIAL_ACCOUNTS
+(variabili d'ambiente), come prima.
+"""
+import os
+import threading
+
+from cache import DataVersion, track_model_writes
+from config import Config
+from models import db, AccountSettings
+
+PLATFORMS = ('facebook', 'instagram', 'linkedin', 'twitter', 'pinterest')
+
+
+class AccountRegistry:
+    """Copia in memoria degli account, legata alla versione condivisa"""
+
+    def __init__(self):
+        self.version = DataVersion()
+        self._loaded_version = None
+        self._accounts = None
+        self._lock = threading.Lock()
+
+    def configure(self, cache_dir):
+        """Imposta la directory del file di versione e svuota la copia"""
+        self.version.path = os.path.join(cache_dir, 'accounts_version')
+        self.invalidate()
+
+    def invalidate(self):
+        """Forza la rilettura dal database al prossimo accesso"""
+        with self._lock:
+            self._loaded_version = None
+            self._accounts = None
+
+    def all(self):
+        """
+        Account per piattaforma (query solo se la versione è cambiata)
+
+        Returns:
+            dict: {platform: {'account_id', 'account_username', 'is_active',
+                'pinterest_default_board', 'source'}}; source è 'db' oppure 'config'
+        """
+        version = self.version.current()
+        accounts = self._accounts
+        if accounts is not None and self._loaded_version == version:
+            return accounts
+        accounts = _load_accounts()
+        with self._lock:
+            self._accounts = accounts
+            self._loaded_version = version
+        return accounts
+
+
+def _load_accounts():
+    """Legge account_settings e completa con Config.SOCIAL_ACCOUNTS"""
+    accounts = {}
+    for platform in PLATFORMS:
+        account_id = Config.SOCIAL_ACCOUNTS.get(platform) or ''
+        accounts[platform] = {
+            'account_id': account_id,
+            'account_username': None,
+            'is_active': bool(account_id),
+            'pinterest_default_board': Config.PINTEREST_DEFAULT_BOARD if platform == 'pinterest' else None,
+            'source': 'config'
+        }
+    for row in AccountSettings.query.all():
+        accounts[row.platform] = {
+            'account_id': row.account_id,
+            'account_username': row.account_username,
+            'is_active': bool(row.is_active) and bool(row.account_id),
+            'pinterest_default_board': row.pinterest_default_board
+                or (Config.PINTEREST_DEFAULT_BOARD if row.platform == 'pinterest' else None),
+            'source': 'db'
+        }
+    return accounts
+
+
+registry = AccountRegistry()
+
+
+def get_accounts():
+    """Account di tutte le piattaforme (vedi AccountRegistry.all)"""
+    return registry.all()
+
+
+def get_account(platform):
+    """
+    Account attivo della piattaforma
+
+    Returns:
+        dict: Account oppure None se non configurato o disattivato
+    """
+    account = registry.all().get(platform)
+    if not account or not account['is_active']:
+        return None
+    return account
+
+
+def save_accounts(data):
+    """
+    Aggiorna account_settings dai valori del form Impostazioni (senza commit)
+
+    Un ID vuoto elimina la riga: la piattaforma torna ai valori di config.
+    Il form mostra anche gli account letti da config: se l'utente non li
+    modifica non viene creata nessuna riga, così un cambio della variabile
+    d'ambiente continua a valere. Per lo stesso motivo la board Pinterest
+    uguale a PINTEREST_DEFAULT_BOARD non viene copiata nella riga.
+
+    Args:
+        data (dict): {platform: {'account_id', 'is_active', 'pinterest_default_board'}}
+
+    Returns:
+        int: Piattaforme modificate
+    """
+    rows = {row.platform: row for row in AccountSettings.query.all()}
+    current = registry.all()
+    changed = 0
+    for platform, values in data.items():
+        if platform not in PLATFORMS:
+            continue
+        account_id = (values.get('account_id') or '').strip()
+        is_active = bool(values.get('is_active'))
+        board = None
+        if platform == 'pinterest':
+            board = (values.get('pinterest_default_board') or '').strip() or None
+            if board == Config.PINTEREST_DEFAULT_BOARD:
+                board = None
+        row = rows.get(platform)
+        if not account_id:
+            if row is not None:
+                db.session.delete(row)
+                changed += 1
+            continue
+        if row is None:
+            config_account = current[platform]
+            if account_id == config_account['account_id'] and is_active == config_account['is_active'] \
+                    and board is None:
+                # Valori di config mostrati nel form e non modificati
+                continue
+            row = AccountSettings(platform=platform, account_id=account_id)
+            db.session.add(row)
+        row.account_id = account_id
+        row.is_active = is_active
+        if platform == 'pinterest':
+            row.pinterest_default_board = board
+        if row in db.session.new or db.session.is_modified(row):
+            changed += 1
+    return changed
+
+
+def track_accounts():
+    """Registra gli hook che aggiornano la versione account al commit"""
+    if getattr(track_accounts, '_installed', False):
+        return
+    track_accounts._installed = True
+    track_model_writes((AccountSettings,), registry.version.bump)
+
+
+def init_app(app):
+    """Collega la versione account alla CACHE_DIR dell'app e attiva gli hook"""
+    registry.configure(app.config['CACHE_DIR'])
+    track_accounts()
@@ -3,34 +3,39 @@
 nano app.pyFlask Application principale - Social Media Scheduler
 Labirintoambientale.it
 """
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Blueprint, current_app, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from datetime import datetime, timedelta
 import os
-from werkzeug.utils import secure_filename
 import pytz
 
-from models import db, Post, PublicationLog, AccountSettings, PostTemplate
-from late_api import LateAPI, validate_content_length
+from models import db, Post, PostTemplate, PublishJob, PostSeries, SeriesPost
 from config import Config
+from factory import create_db_app, get_late_api, init_schema, init_db_command
+import metrics
+import profiling
+import cache
+import accounts
+import media
+import outbox
+from jobs import job_runner
+from bulk import run_bulk_action, bulk_command
+from post_filters import FilterError, rome_to_utc
+import webhooks
+import archive
+import search
+import export
+import recurrence
+import hashtags
+import duplicates
 
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Inizializza database
-db.init_app(app)
-
-# Crea directory necessarie
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(os.path.join(app.config['BASE_DIR'], 'data'), exist_ok=True)
-
-# Inizializza LATE API client
-late_api = LateAPI(app.config['LATE_API_KEY'])
+bp = Blueprint('main', __name__)
 
 def allowed_file(filename):
     """Verifica se file è consentito"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
-@app.route('/')
+@bp.route('/')
+@cache.cached_page
 def index():
     """Dashboard principale"""
     # Statistiche
@@ -57,7 +62,8 @@ def index():
                          upcoming_posts=upcoming_posts,
                          recent_posts=recent_posts)
 
-@app.route('/posts')
+@bp.route('/posts')
+@cache.cached_page
 def posts_list():
     """Lista tutti i post"""
     status_filter = request.args.get('status', 'all')
@@ -70,7 +76,40 @@ def posts_list():
     
     return render_template('posts_list.html', posts=posts, status_filter=status_filter)
 
-@app.route('/post/create', methods=['GET', 'POST'])
+@bp.route('/archive')
+def archive_view():
+    """Consultazione dei post archiviati"""
+    month = request.args.get('month')
+    status_filter = request.args.get('status', 'all')
+    page = request.args.get('page', 1, type=int)
+    per_page = 50
+    
+    archives = archive.list_archives()
+    if not month and archives:
+        month = archives[0]['month']
+    
+    records = []
+    if month:
+        records = archive.read_archive(
+            month, status=None if status_filter == 'all' else status_filter
+        )
+        if records is None:
+            flash('Archivio non trovato', 'error')
+            return redirect(url_for('main.archive_view'))
+    
+    total = len(records)
+    records = records[(page - 1) * per_page:page * per_page]
+    
+    return render_template('archive.html',
+                         archives=archives,
+                         month=month,
+                         status_filter=status_filter,
+                         records=records,
+                         page=page,
+                         total=total,
+                         has_next=page * per_page < total)
+
+@bp.route('/post/create', methods=['GET', 'POST'])
 def create_post():
     """Crea nuovo post"""
     if request.method == 'POST':
@@ -86,16 +125,17 @@ def create_post():
         # Validazione
         if not content or not platforms:
             flash('Contenuto e piattaforme sono obbligatori', 'error')
-            return redirect(url_for('create_post'))
+            return redirect(url_for('main.create_post'))
         
         # Valida lunghezza contenuto per ogni piattaforma
+        from late_api import validate_content_length
         for platform in platforms:
             is_valid, message = validate_content_length(
-                content, platform, app.config['MAX_POST_LENGTH']
+                content, platform, current_app.config['MAX_POST_LENGTH']
             )
             if not is_valid:
                 flash(message, 'error')
-                return redirect(url_for('create_post'))
+                return redirect(url_for('main.create_post'))
         
         # Parse data/ora scheduling
         try:
@@ -108,20 +148,28 @@ def create_post():
             scheduled_datetime_utc = scheduled_datetime.astimezone(pytz.UTC).replace(tzinfo=None)
         except ValueError:
             flash('Data/ora non valida', 'error')
-            return redirect(url_for('create_post'))
+            return redirect(url_for('main.create_post'))
         
-        # Upload immagine se presente
+        # Quasi-duplicati vicini nel tempo (salvo conferma esplicita dall'editor)
+        if current_app.config['DUPLICATE_CHECK'] and not request.form.get('allow_duplicate'):
+            similar = duplicates.find_similar(content, scheduled_datetime_utc)
+            if similar:
+                matches = ', '.join(f"#{m['post_id']} ({int(m['similarity'] * 100)}%)" for m in similar[:3])
+                flash(f'Contenuto quasi identico a post programmati vicino a questa data: {matches}', 'error')
+                return redirect(url_for('main.create_post'))
+        
+        # Upload immagine o video se presente
         image_url = None
+        video_url = None
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Aggiungi timestamp per unicità
-                filename = f"{int(datetime.now().timestamp())}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                # URL relativo per accesso web
-                image_url = f"/static/uploads/{filename}"
+                # Nome = hash del contenuto: URL /media/... in cache per sempre
+                media_url = media.save_upload(file)
+                if media.is_video(file.filename):
+                    video_url = media_url
+                else:
+                    image_url = media_url
         
         # Crea post
         post = Post(
@@ -131,6 +179,7 @@ def create_post():
             template_name=template_name if template_name else None,
             notes=notes,
             image_url=image_url,
+            video_url=video_url,
             pinterest_link=pinterest_link if 'pinterest' in platforms else None,
             status='scheduled'
         )
@@ -138,16 +187,21 @@ def create_post():
         db.session.add(post)
         db.session.commit()
         
+        # Hand-off: programma subito il post sullo scheduler LATE
+        if current_app.config['LATE_HANDOFF']:
+            job_runner.submit_handoff(post.id)
+        
         flash(f'Post programmato con successo per {scheduled_datetime.strftime("%d/%m/%Y %H:%M")}', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     # GET - mostra form
     templates = PostTemplate.query.all()
     return render_template('create_post.html', 
                          templates=templates,
-                         post_templates=app.config['POST_TEMPLATES'])
+                         post_templates=current_app.config['POST_TEMPLATES'],
                          now=datetime.now())
-@app.route('/post/<int:post_id>/edit', methods=['GET', 'POST'])
+
+@bp.route('/post/<int:post_id>/edit', methods=['GET', 'POST'])
 def edit_post(post_id):
     """Modifica post esistente"""
     post = Post.query.get_or_404(post_id)
@@ -158,6 +212,7 @@ def edit_post(post_id):
         post.notes = request.form.get('notes')
         
         # Aggiorna scheduling solo se non ancora pubblicato
+        previous_date = post.scheduled_date
         if post.status == 'scheduled':
             scheduled_date_str = request.form.get('scheduled_date')
             scheduled_time_str = request.form.get('scheduled_time')
@@ -170,28 +225,64 @@ def edit_post(post_id):
             scheduled_datetime = rome_tz.localize(scheduled_datetime)
             post.scheduled_date = scheduled_datetime.astimezone(pytz.UTC).replace(tzinfo=None)
         
+        # Consegne già in outbox (retry in corso): nuove piattaforme e nuova data
+        handoff = current_app.config['LATE_HANDOFF']
+        if post.status == 'scheduled' and not handoff:
+            outbox.update_edited_post(post, post.scheduled_date != previous_date)
+        
         db.session.commit()
+        
+        # Hand-off: riprogramma su LATE con contenuto e data aggiornati
+        if handoff and post.status == 'scheduled':
+            job_runner.submit_handoff(post.id)
+        
         flash('Post aggiornato con successo', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     return render_template('edit_post.html', post=post)
 
-@app.route('/post/<int:post_id>/delete', methods=['POST'])
+@bp.route('/post/<int:post_id>/delete', methods=['POST'])
 def delete_post(post_id):
     """Elimina post"""
     post = Post.query.get_or_404(post_id)
     
     # Se programmato su LATE, elimina anche da lì
     if post.late_post_id and post.status == 'scheduled':
-        late_api.delete_scheduled_post(post.late_post_id)
+        get_late_api().delete_scheduled_post(post.late_post_id)
+    for delivery in post.deliveries:
+        if delivery.remote_status == 'scheduled' and delivery.late_post_id:
+            get_late_api().delete_scheduled_post(delivery.late_post_id)
     
     db.session.delete(post)
     db.session.commit()
     
     flash('Post eliminato', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/calendar')
+@bp.route('/api/posts/bulk', methods=['POST'])
+def posts_bulk():
+    """API per azioni massive sui post (delete, reschedule, autoschedule, retry)"""
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        summary, futures = run_bulk_action(
+            data.get('action'),
+            data.get('filters'),
+            get_late_api(),
+            scheduled_date=data.get('scheduled_date'),
+            shift_minutes=data.get('shift_minutes'),
+            start_date=data.get('start_date'),
+            dry_run=data.get('dry_run')
+        )
+    except FilterError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Le operazioni LATE proseguono in background
+    summary.update({'success': True, 'background_tasks': len(futures)})
+    return jsonify(summary)
+
+@bp.route('/calendar')
+@cache.cached_page
 def calendar():
     """Calendario visuale post programmati"""
     posts = Post.query.filter_by(status='scheduled').all()
@@ -207,46 +298,182 @@ def calendar():
             'title': post.content[:50] + '...' if len(post.content) > 50 else post.content,
             'start': scheduled_rome.isoformat(),
             'platforms': post.get_platforms_list(),
-            'url': url_for('edit_post', post_id=post.id)
+            'url': url_for('main.edit_post', post_id=post.id)
         })
     
     return render_template('calendar.html', events=events)
 
-@app.route('/templates')
+@bp.route('/templates')
 def templates_list():
     """Gestione template"""
     templates = PostTemplate.query.all()
-    config_templates = app.config['POST_TEMPLATES']
+    config_templates = current_app.config['POST_TEMPLATES']
     
     return render_template('templates.html', 
                          templates=templates,
                          config_templates=config_templates)
 
-@app.route('/settings', methods=['GET', 'POST'])
+@bp.route('/media/<path:filename>')
+def media_file(filename):
+    """Immagini e video caricati: cache, ETag e richieste Range"""
+    return media.serve(filename)
+
+@bp.route('/settings', methods=['GET', 'POST'])
 def settings():
     """Impostazioni account e configurazione"""
     if request.method == 'POST':
-        # Aggiorna impostazioni
-        for platform in ['facebook', 'instagram', 'linkedin', 'twitter', 'pinterest']:
-            account_id = request.form.get(f'{platform}_account_id')
-            if account_id:
-                app.config['SOCIAL_ACCOUNTS'][platform] = account_id
+        # Salva in account_settings: la modifica vale per tutti i worker e per il cron
+        data = {}
+        for platform in accounts.PLATFORMS:
+            data[platform] = {
+                'account_id': request.form.get(f'{platform}_account_id', ''),
+                'is_active': request.form.get(f'{platform}_active') == '1',
+                'pinterest_default_board': request.form.get(f'{platform}_default_board', '')
+            }
+        try:
+            changed = accounts.save_accounts(data)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Errore nel salvataggio: {str(e)}', 'error')
+            return redirect(url_for('main.settings'))
         
-        flash('Impostazioni aggiornate', 'success')
-        return redirect(url_for('settings'))
+        flash(f'Impostazioni aggiornate ({changed} account modificati)', 'success')
+        return redirect(url_for('main.settings'))
     
     # Recupera account connessi da LATE
-    accounts_response = late_api.get_accounts()
+    accounts_response = get_late_api().get_accounts()
     late_accounts = accounts_response.get('accounts', []) if accounts_response['success'] else []
     
+    configured = accounts.get_accounts()
     return render_template('settings.html',
-                         social_accounts=app.config['SOCIAL_ACCOUNTS'],
+                         accounts=configured,
+                         social_accounts={platform: account['account_id'] if account['is_active'] else ''
+                                          for platform, account in configured.items()},
                          late_accounts=late_accounts)
 
-@app.route('/api/template/<template_name>')
+@bp.route('/api/search')
+def search_posts():
+    """API ricerca full-text sui post (ordinata per rilevanza)"""
+    try:
+        result = search.search_posts(
+            request.args.get('q'),
+            status=request.args.get('status'),
+            platform=request.args.get('platform'),
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('per_page', 20, type=int)
+        )
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    except search.SearchUnavailableError as e:
+        print(f"⚠️  {e}")
+        return jsonify({'error': str(e)}), 503
+    
+    return jsonify(result)
+
+@bp.route('/export/<dataset>.<fmt>')
+def export_data(dataset, fmt):
+    """Export in streaming di post o storico pubblicazioni (CSV/NDJSON)"""
+    if dataset not in export.DATASETS or fmt not in export.FORMATS:
+        return jsonify({'error': 'Export non supportato'}), 404
+    
+    filters = {key: request.args.get(key)
+               for key in ('status', 'platform', 'date_from', 'date_to')}
+    try:
+        chunks = export.generate_export(dataset, fmt, filters)
+    except FilterError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"{dataset}-{datetime.now().strftime('%Y%m%d-%H%M')}.{fmt}"
+    return Response(stream_with_context(chunks),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@bp.route('/api/series', methods=['GET', 'POST'])
+def series_api():
+    """Elenco e creazione delle serie ricorrenti"""
+    if request.method == 'GET':
+        series = PostSeries.query.order_by(PostSeries.created_at.desc()).all()
+        return jsonify({'success': True, 'series': [s.to_dict() for s in series]})
+    
+    try:
+        series = recurrence.create_series(request.get_json(silent=True) or {})
+        db.session.commit()
+    except recurrence.SeriesError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Crea subito le occorrenze della finestra, visibili nel calendario
+    window_end = datetime.utcnow() + timedelta(days=current_app.config['SERIES_WINDOW_DAYS'])
+    created = recurrence.expand_series(series, window_end)
+    if current_app.config['LATE_HANDOFF']:
+        for post_id, in db.session.query(SeriesPost.post_id).filter_by(series_id=series.id):
+            job_runner.submit_handoff(post_id)
+    
+    return jsonify({'success': True, 'series': series.to_dict(), 'posts_created': created}), 201
+
+@bp.route('/api/series/<int:series_id>', methods=['DELETE'])
+def delete_series(series_id):
+    """Interrompe una serie ed elimina le occorrenze future non pubblicate"""
+    series = PostSeries.query.get_or_404(series_id)
+    post_ids = recurrence.stop_series(series)
+    db.session.commit()
+    
+    deleted = 0
+    if post_ids:
+        # Come l'azione massiva: eliminazioni LATE in background
+        summary, _ = run_bulk_action('delete', {'ids': post_ids}, get_late_api())
+        deleted = summary['affected']
+    return jsonify({'success': True, 'deleted_posts': deleted})
+
+@bp.route('/api/hashtags')
+def hashtags_stats():
+    """Utilizzi per hashtag (più usati per primi)"""
+    try:
+        stats = hashtags.hashtag_stats(
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            limit=request.args.get('limit', 50, type=int)
+        )
+    except FilterError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'hashtags': stats})
+
+@bp.route('/api/hashtags/suggest')
+def hashtags_suggest():
+    """Suggerimenti hashtag per l'editor (prefisso ?q=)"""
+    suggestions = hashtags.suggest(request.args.get('q', ''),
+                                   limit=request.args.get('limit', 10, type=int))
+    return jsonify({'success': True, 'suggestions': suggestions})
+
+@bp.route('/api/posts/similar', methods=['POST'])
+def similar_posts():
+    """Post quasi identici programmati vicino alla data indicata"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Corpo JSON non valido: atteso un oggetto'}), 400
+    content = data.get('content', '')
+    if not isinstance(content, str):
+        return jsonify({'success': False, 'error': 'content deve essere una stringa'}), 400
+    exclude_id = data.get('exclude_id')
+    if exclude_id is not None and (isinstance(exclude_id, bool) or not isinstance(exclude_id, int)):
+        return jsonify({'success': False, 'error': 'exclude_id deve essere un intero'}), 400
+    try:
+        scheduled_date = rome_to_utc(data['scheduled_date'], '%Y-%m-%d %H:%M') \
+            if data.get('scheduled_date') else None
+    except FilterError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    similar = duplicates.find_similar(content, scheduled_date, exclude_id=exclude_id)
+    return jsonify({'success': True, 'similar': similar})
+
+@bp.route('/api/template/<template_name>')
 def get_template(template_name):
     """API per recuperare contenuto template"""
-    templates = app.config['POST_TEMPLATES']
+    templates = current_app.config['POST_TEMPLATES']
     
     if template_name in templates:
         return jsonify(templates[template_name])
@@ -254,30 +481,104 @@ def get_template(template_name):
     return jsonify({'error': 'Template non trovato'}), 404
 
 
-@app.route('/publish-now/<int:post_id>', methods=['POST'])
+@bp.route('/publish-now/<int:post_id>', methods=['POST'])
 def publish_now(post_id):
-    """Pubblica immediatamente un post programmato"""
+    """Accoda la pubblicazione immediata di un post programmato"""
     post = Post.query.get_or_404(post_id)
     
     if post.status != 'scheduled':
         return jsonify({'error': 'Post già pubblicato o non programmato'}), 400
     
-    # Usa lo script di pubblicazione
-    from publish_scheduled_posts import publish_post
+    # La pubblicazione avviene nel pool in background: il worker web resta libero
+    job, created = job_runner.enqueue(post)
     
-    success = publish_post(post, late_api)
-    db.session.commit()
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('main.job_status', job_id=job.id),
+        'message': 'Pubblicazione avviata' if created else 'Pubblicazione già in corso'
+    }), 202
+
+@bp.route('/api/job/<int:job_id>')
+def job_status(job_id):
+    """API per lo stato di un job di pubblicazione"""
+    job = db.session.get(PublishJob, job_id)
+    
+    if job is None:
+        return jsonify({'error': 'Job non trovato'}), 404
+    
+    return jsonify(job.to_dict())
+
+@bp.route('/webhooks/late', methods=['POST'])
+def late_webhook():
+    """Riceve le callback di stato pubblicazione da LATE"""
+    secret = current_app.config['LATE_WEBHOOK_SECRET']
+    if not secret:
+        return jsonify({'error': 'Webhook non configurato'}), 503
+    
+    body = request.get_data()
+    signature = request.headers.get(current_app.config['LATE_WEBHOOK_SIGNATURE_HEADER'])
+    if not webhooks.verify_signature(body, signature, secret):
+        return jsonify({'error': 'Firma non valida'}), 401
+    
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Payload non valido'}), 400
+    
+    # Salva e rispondi subito: l'elaborazione avviene a lotti in background
+    event, created = webhooks.store_event(payload)
+    if created:
+        webhooks.schedule_flush(current_app._get_current_object())
+    
+    return jsonify({'success': True, 'event_id': event.id, 'duplicate': not created}), 202
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Metriche in formato Prometheus aggregate su tutti i worker"""
+    queue_depth = Post.query.filter(
+        Post.status == 'scheduled',
+        Post.scheduled_date <= datetime.utcnow()
+    ).count()
+    
+    body = metrics.registry.render(gauges=[
+        ('scheduler_queue_depth', 'Post programmati già scaduti in attesa di pubblicazione', queue_depth)
+    ])
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def create_app(config_object=Config):
+    """
+    Application factory: nessuna query né chiamata LATE all'avvio
+    
+    Lo schema del database si crea con `flask --app app init-db`.
+    """
+    app = create_db_app(config_object)
+    app.register_blueprint(bp)
+    
+    # Metriche Prometheus (latenze route, query DB, chiamate LATE)
+    metrics.init_app(app)
+    
+    # Profilazione SQL opzionale (SQL_PROFILING=1)
+    profiling.init_app(app)
+    
+    # Pool in background per i job di pubblicazione
+    job_runner.init_app(app)
+    
+    # Comandi CLI (flask --app app <comando>)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(bulk_command)
+    app.cli.add_command(archive.archive_command)
+    app.cli.add_command(export.export_command)
+    app.cli.add_command(recurrence.series_command)
+    app.cli.add_command(hashtags.reindex_command)
+    app.cli.add_command(duplicates.reindex_command)
     
-    if success:
-        return jsonify({'success': True, 'message': 'Post pubblicato'})
-    else:
-        return jsonify({'success': False, 'error': post.error_message}), 500
+    return app
 
-# Inizializza database al primo avvio
-with app.app_context():
-    db.create_all()
-    print("✅ Database inizializzato")
+app = create_app()
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_schema()
     port = int(os.environ.get("PORT", 10000))
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Archiviazione dei post pubblicati/falliti e manutenzione del database
+Labirintoambientale.it
+
+I post conclusi più vecchi di RETENTION_DAYS vengono scritti, con i loro
+log di pubblicazione, in file mensili NDJSON compressi (ARCHIVE_DIR) e poi
+rimossi dal database. I file restano consultabili dalla vista /archive.
+Dopo lo spostamento l'incremental VACUUM restituisce al filesystem le
+pagine liberate, così il database "caldo" resta piccolo.
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import (db, Post, PublicationLog, PublishJob, Delivery, SeriesPost, PostHashtag,
+                    ContentSignature, ContentBucket, WebhookEvent)
+from config import Config
+
+ARCHIVE_STATUSES = ('published', 'failed')
+ARCHIVE_FILE_PATTERN = re.compile(r'^posts-(\d{4}-\d{2})\.jsonl\.gz$')
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _post_record(post, logs):
+    """Record di archivio: post completo con i log di pubblicazione"""
+    record = post.to_dict()
+    record.update({
+        'error_message': post.error_message,
+        'pinterest_board_id': post.pinterest_board_id,
+        'pinterest_link': post.pinterest_link,
+        'updated_at': _isoformat(post.updated_at),
+        'archived_at': datetime.utcnow().isoformat(),
+        'logs': [{
+            'platform': log.platform,
+            'status': log.status,
+            'error_message': log.error_message,
+            'published_url': log.published_url,
+            'late_response': log.late_response,
+            'attempted_at': _isoformat(log.attempted_at)
+        } for log in logs]
+    })
+    return record
+
+
+def archive_path(month, archive_dir=None):
+    """Percorso del file di archivio per un mese 'YYYY-MM'"""
+    return os.path.join(archive_dir or Config.ARCHIVE_DIR, f'posts-{month}.jsonl.gz')
+
+
+def _append_records(month, records, archive_dir):
+    """
+    Aggiunge record al file del mese come nuovo membro gzip
+
+    I file gzip concatenati sono leggibili come un unico flusso, quindi
+    l'append non richiede di riscrivere l'archivio esistente.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(month, archive_dir)
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def archive_old_posts(retention_days=None, batch_size=500, archive_dir=None):
+    """
+    Sposta negli archivi mensili i post conclusi più vecchi della retention
+
+    Ogni lotto viene prima scritto (e sincronizzato) su file e solo dopo
+    eliminato dal database. In caso di interruzione tra i due passi un post
+    può comparire due volte nell'archivio: la lettura tiene l'ultima copia.
+
+    Returns:
+        int: Numero di post archiviati (0 se la retention è disattivata)
+    """
+    retention_days = retention_days if retention_days is not None else Config.RETENTION_DAYS
+    if not retention_days or retention_days <= 0:
+        return 0
+    archive_dir = archive_dir or Config.ARCHIVE_DIR
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    archived = 0
+
+    while True:
+        posts = Post.query.filter(
+            Post.status.in_(ARCHIVE_STATUSES),
+            Post.scheduled_date < cutoff
+        ).order_by(Post.id.asc()).limit(batch_size).all()
+        if not posts:
+            break
+
+        post_ids = [post.id for post in posts]
+        logs_by_post = {}
+        for log in PublicationLog.query.filter(PublicationLog.post_id.in_(post_ids)) \
+                .order_by(PublicationLog.id.asc()):
+            logs_by_post.setdefault(log.post_id, []).append(log)
+
+        by_month = {}
+        for post in posts:
+            month = post.scheduled_date.strftime('%Y-%m')
+            by_month.setdefault(month, []).append(_post_record(post, logs_by_post.get(post.id, [])))
+        for month, records in sorted(by_month.items()):
+            _append_records(month, records, archive_dir)
+
+        PublicationLog.query.filter(PublicationLog.post_id.in_(post_ids)).delete(synchronize_session=False)
+        PublishJob.query.filter(PublishJob.post_id.in_(post_ids)).delete(synchronize_session=False)
+        Delivery.query.filter(Delivery.post_id.in_(post_ids)).delete(synchronize_session=False)
+        SeriesPost.query.filter(SeriesPost.post_id.in_(post_ids)).delete(synchronize_session=False)
+        ContentBucket.query.filter(ContentBucket.post_id.in_(post_ids)).delete(synchronize_session=False)
+        ContentSignature.query.filter(ContentSignature.post_id.in_(post_ids)).delete(synchronize_session=False)
+        # Gli hashtag restano nelle statistiche, scollegati dal post archiviato
+        PostHashtag.query.filter(PostHashtag.post_id.in_(post_ids)).update(
+            {'post_id': None}, synchronize_session=False)
+        Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+        archived += len(post_ids)
+
+    # Gli eventi webhook già elaborati servono solo per la deduplica recente
+    WebhookEvent.query.filter(
+        WebhookEvent.status.in_(('processed', 'ignored')),
+        WebhookEvent.received_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return archived
+
+
+def incremental_vacuum(max_pages=None):
+    """
+    Restituisce al filesystem le pagine libere del database SQLite
+
+    Al primo utilizzo attiva auto_vacuum=INCREMENTAL, che richiede un VACUUM
+    completo una tantum; dalle esecuzioni successive basta
+    PRAGMA incremental_vacuum.
+
+    Returns:
+        int: Pagine libere prima dell'operazione
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return 0
+
+    # VACUUM non può girare dentro una transazione
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        freelist = conn.execute(text('PRAGMA freelist_count')).scalar()
+        if conn.execute(text('PRAGMA auto_vacuum')).scalar() != 2:
+            conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+            conn.execute(text('VACUUM'))
+        elif freelist:
+            pages = f'({int(max_pages)})' if max_pages else ''
+            conn.execute(text(f'PRAGMA incremental_vacuum{pages}'))
+    return freelist
+
+
+def list_archives(archive_dir=None):
+    """
+    Elenca i file di archivio disponibili
+
+    Returns:
+        list: Dizionari {'month', 'size'} ordinati dal mese più recente
+    """
+    archive_dir = archive_dir or Config.ARCHIVE_DIR
+    if not os.path.isdir(archive_dir):
+        return []
+    archives = []
+    for filename in os.listdir(archive_dir):
+        match = ARCHIVE_FILE_PATTERN.match(filename)
+        if match:
+            archives.append({
+                'month': match.group(1),
+                'size': os.path.getsize(os.path.join(archive_dir, filename))
+            })
+    return sorted(archives, key=lambda a: a['month'], reverse=True)
+
+
+def read_archive(month, status=None, archive_dir=None):
+    """
+    Legge i post archiviati di un mese
+
+    Args:
+        month (str): Mese 'YYYY-MM'
+        status (str): Filtra per stato ('published' o 'failed')
+
+    Returns:
+        list: Record ordinati per data programmata (None se il mese non esiste)
+    """
+    if not re.match(r'^\d{4}-\d{2}$', month or ''):
+        return None
+    path = archive_path(month, archive_dir)
+    if not os.path.exists(path):
+        return None
+
+    records = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[record['id']] = record  # L'ultima copia vince
+    result = [r for r in records.values() if not status or r.get('status') == status]
+    return sorted(result, key=lambda r: r.get('scheduled_date') or '')
+
+
+@click.command('archive-posts')
+@click.option('--days', type=int, help='Giorni di retention (default RETENTION_DAYS)')
+@click.option('--no-vacuum', is_flag=True, help='Non eseguire incremental VACUUM')
+@with_appcontext
+def archive_command(days, no_vacuum):
+    """Archivia i post conclusi più vecchi della retention e compatta il DB"""
+    if not (days or Config.RETENTION_DAYS):
+        raise click.UsageError('Archiviazione disattivata: indicare --days oppure impostare RETENTION_DAYS')
+    archived = archive_old_posts(retention_days=days)
+    click.echo(f"📦 Post archiviati: {archived}")
+    if not no_vacuum:
+        freed = incremental_vacuum()
+        click.echo(f"🧹 Pagine libere recuperate: {freed}")
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Azioni massive sui post (elimina, riprogramma, programma automaticamente,
+riprova falliti)
+Labirintoambientale.it
+
+Le modifiche al database avvengono in un'unica transazione; le chiamate
+LATE conseguenti (eliminazioni remote, nuove pubblicazioni) vengono
+eseguite in parallelo dal pool in background dopo il commit.
+"""
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import (db, Post, PublicationLog, PublishJob, Delivery, SeriesPost, PostHashtag,
+                    ContentSignature, ContentBucket)
+from post_filters import FilterError, apply_post_filters, rome_to_utc
+from jobs import job_runner
+import outbox
+import slots
+
+ACTIONS = ('delete', 'reschedule', 'autoschedule', 'retry')
+
+
+class BulkActionError(FilterError):
+    """Parametri non validi per un'azione massiva"""
+
+
+def filter_posts(filters):
+    """
+    Costruisce la query dei post selezionati
+
+    Args:
+        filters (dict): Chiavi supportate: ids, status, platform,
+            date_from, date_to (YYYY-MM-DD, ora di Roma, sulla scheduled_date)
+
+    Returns:
+        Query: Query SQLAlchemy sui post selezionati
+    """
+    if filters is not None and not isinstance(filters, dict):
+        raise BulkActionError('filters deve essere un oggetto {chiave: valore}')
+    filters = {k: v for k, v in (filters or {}).items() if v not in (None, '', [])}
+    if not filters:
+        # Evita di operare su tutta la tabella per errore
+        raise BulkActionError('Specificare almeno un filtro')
+    return apply_post_filters(Post.query, filters)
+
+
+def _delete_remote(late_api, late_post_id):
+    """Elimina un post programmato su LATE (eseguito nel pool)"""
+    result = late_api.delete_scheduled_post(late_post_id)
+    if not result['success']:
+        print(f"❌ Eliminazione LATE {late_post_id} fallita: {result.get('error')}")
+    return result
+
+
+def bulk_delete(query, late_api):
+    """Elimina i post selezionati con log e job associati"""
+    rows = query.with_entities(Post.id, Post.status, Post.late_post_id).all()
+    post_ids = [row.id for row in rows]
+    remote_ids = [row.late_post_id for row in rows
+                  if row.late_post_id and row.status == 'scheduled']
+    if post_ids:
+        # Consegne programmate sullo scheduler LATE (modalità hand-off)
+        remote_ids += [late_id for late_id, in db.session.query(Delivery.late_post_id).filter(
+            Delivery.post_id.in_(post_ids),
+            Delivery.remote_status == 'scheduled',
+            Delivery.late_post_id.isnot(None)
+        )]
+    remote_ids = list(dict.fromkeys(remote_ids))
+
+    if post_ids:
+        PublicationLog.query.filter(PublicationLog.post_id.in_(post_ids)).delete(synchronize_session=False)
+        PublishJob.query.filter(PublishJob.post_id.in_(post_ids)).delete(synchronize_session=False)
+        Delivery.query.filter(Delivery.post_id.in_(post_ids)).delete(synchronize_session=False)
+        SeriesPost.query.filter(SeriesPost.post_id.in_(post_ids)).delete(synchronize_session=False)
+        ContentBucket.query.filter(ContentBucket.post_id.in_(post_ids)).delete(synchronize_session=False)
+        ContentSignature.query.filter(ContentSignature.post_id.in_(post_ids)).delete(synchronize_session=False)
+        PostHashtag.query.filter(PostHashtag.post_id.in_(post_ids)).delete(synchronize_session=False)
+        Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+    futures = [job_runner.executor.submit(_delete_remote, late_api, late_id)
+               for late_id in remote_ids]
+    return {'affected': len(post_ids), 'remote_deletions': len(remote_ids)}, futures
+
+
+def _requeue_deliveries(posts):
+    """
+    Porta alla nuova data le consegne dei post riprogrammati
+
+    Le consegne fallite tornano in coda: un post fallito tornerebbe
+    'scheduled' con consegne ancora 'failed', che enqueue_due_posts salta (ha
+    già consegne) e drain ignora, quindi non verrebbe mai inviato. Quelle in
+    attesa di retry partirebbero invece al vecchio orario di backoff.
+    """
+    post_ids = [post.id for post in posts]
+    outbox.reset_failed(post_ids, at_scheduled_date=True)
+    outbox.reschedule_pending(post_ids)
+
+
+def _submit_handoffs(posts):
+    """Modalità hand-off: riprogramma su LATE i post con la nuova data"""
+    if not current_app.config.get('LATE_HANDOFF'):
+        return []
+    return [job_runner.submit_handoff(post.id) for post in posts]
+
+
+def _mark_scheduled(post):
+    """Dopo il cambio di data i post falliti tornano programmati; le bozze restano bozze"""
+    if post.status != 'draft':
+        post.status = 'scheduled'
+    post.error_message = None
+
+
+def bulk_reschedule(query, scheduled_date=None, shift_minutes=None):
+    """
+    Riprogramma i post non pubblicati a una data fissa o spostandoli di N minuti
+
+    Le bozze ricevono la nuova data ma restano bozze: non vengono pubblicate.
+    """
+    if scheduled_date is None and shift_minutes is None:
+        raise BulkActionError('Indicare scheduled_date oppure shift_minutes')
+    if scheduled_date is not None:
+        new_date = rome_to_utc(scheduled_date, '%Y-%m-%d %H:%M')
+    else:
+        try:
+            shift_minutes = int(shift_minutes)
+        except (TypeError, ValueError):
+            raise BulkActionError(f'shift_minutes non valido: {shift_minutes}')
+
+    posts = query.filter(Post.status != 'published').all()
+    for post in posts:
+        if scheduled_date is not None:
+            post.scheduled_date = new_date
+        else:
+            post.scheduled_date = post.scheduled_date + timedelta(minutes=shift_minutes)
+        _mark_scheduled(post)
+    _requeue_deliveries(posts)
+    db.session.commit()
+    return {'affected': len(posts)}, _submit_handoffs(posts)
+
+
+def bulk_autoschedule(query, start_date=None, dry_run=False):
+    """
+    Assegna ai post non pubblicati il primo orario ottimale libero
+
+    Come in bulk_reschedule le bozze ricevono l'orario ma restano bozze.
+
+    Args:
+        query (Query): Post selezionati (assegnati in ordine di data e ID)
+        start_date (str): Non prima del giorno YYYY-MM-DD (ora di Roma)
+        dry_run (bool): Calcola le assegnazioni senza salvarle
+    """
+    start = rome_to_utc(start_date) if start_date else None
+    posts = query.filter(Post.status != 'published') \
+        .order_by(Post.scheduled_date.asc(), Post.id.asc()).all()
+    assignments = slots.allocate(posts, start=start)
+
+    assigned = [post for post in posts if post.id in assignments]
+    for post in assigned:
+        post.scheduled_date = assignments[post.id]
+        _mark_scheduled(post)
+
+    summary = {
+        'affected': 0 if dry_run else len(assigned),
+        'assignments': [{'post_id': post.id, 'scheduled_date': assignments[post.id].isoformat()}
+                        for post in assigned],
+        'unassigned': [post.id for post in posts if post.id not in assignments],
+    }
+    if dry_run:
+        db.session.rollback()
+        return summary, []
+    _requeue_deliveries(assigned)
+    db.session.commit()
+    return summary, _submit_handoffs(assigned)
+
+
+def bulk_retry(query):
+    """Rimette in coda i post falliti e ne avvia la pubblicazione in parallelo"""
+    posts = query.filter(Post.status == 'failed').all()
+    for post in posts:
+        post.status = 'scheduled'
+        post.error_message = None
+    # Solo le piattaforme fallite vengono ritentate
+    outbox.reset_failed([post.id for post in posts])
+    jobs = job_runner.create_jobs(posts)
+    db.session.commit()
+
+    futures = job_runner.submit_jobs(jobs)
+    return {'affected': len(posts), 'job_ids': [job.id for job in jobs]}, futures
+
+
+def run_bulk_action(action, filters, late_api, **options):
+    """
+    Esegue un'azione massiva sui post filtrati
+
+    Args:
+        action (str): 'delete', 'reschedule', 'autoschedule' o 'retry'
+        filters (dict): Filtri per filter_posts()
+        late_api (LateAPI): Client LATE per le operazioni remote
+        **options: scheduled_date / shift_minutes per 'reschedule',
+            start_date / dry_run per 'autoschedule'
+
+    Returns:
+        tuple: (riepilogo dict, lista futures delle operazioni in background)
+    """
+    if action not in ACTIONS:
+        raise BulkActionError(f'Azione non supportata: {action}')
+
+    dry_run = options.get('dry_run')
+    if dry_run is not None and not isinstance(dry_run, bool):
+        # Una stringa come "false" sarebbe vera: solo booleani JSON
+        raise BulkActionError(f'dry_run deve essere true o false, non {dry_run!r}')
+
+    query = filter_posts(filters)
+    try:
+        if action == 'delete':
+            return bulk_delete(query, late_api)
+        if action == 'reschedule':
+            return bulk_reschedule(query, options.get('scheduled_date'), options.get('shift_minutes'))
+        if action == 'autoschedule':
+            return bulk_autoschedule(query, options.get('start_date'), bool(dry_run))
+        return bulk_retry(query)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+@click.command('posts-bulk')
+@click.argument('action', type=click.Choice(ACTIONS))
+@click.option('--id', 'ids', multiple=True, type=int, help='ID post (ripetibile)')
+@click.option('--status', help='Filtra per stato (scheduled, failed, ...)')
+@click.option('--platform', help='Filtra per piattaforma')
+@click.option('--date-from', help='Dal giorno YYYY-MM-DD (ora di Roma)')
+@click.option('--date-to', help='Al giorno YYYY-MM-DD incluso (ora di Roma)')
+@click.option('--scheduled-date', help="Nuova data 'YYYY-MM-DD HH:MM' per reschedule")
+@click.option('--shift-minutes', type=int, help='Sposta di N minuti per reschedule')
+@click.option('--start-date', help='Non prima del giorno YYYY-MM-DD per autoschedule')
+@click.option('--dry-run', is_flag=True, help='Mostra le assegnazioni di autoschedule senza salvarle')
+@with_appcontext
+def bulk_command(action, ids, status, platform, date_from, date_to, scheduled_date, shift_minutes,
+                 start_date, dry_run):
+    """Azione massiva sui post filtrati (delete, reschedule, autoschedule, retry)"""
+    filters = {'ids': list(ids), 'status': status, 'platform': platform,
+               'date_from': date_from, 'date_to': date_to}
+    try:
+        summary, futures = run_bulk_action(
+            action, filters, job_runner.late_api,
+            scheduled_date=scheduled_date, shift_minutes=shift_minutes,
+            start_date=start_date, dry_run=dry_run
+        )
+    except FilterError as e:
+        raise click.UsageError(str(e))
+
+    click.echo(f"✅ {action}: {summary['affected']} post")
+    for item in summary.get('assignments', []):
+        click.echo(f"   #{item['post_id']} → {item['scheduled_date']} UTC")
+    if summary.get('unassigned'):
+        click.echo(f"⚠️  Nessun orario libero per: {summary['unassigned']}")
+    if futures:
+        click.echo(f"⏳ Attesa di {len(futures)} operazioni LATE in background...")
+        for future in futures:
+            future.result()
+    click.echo('Completato')
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Cache delle pagine con invalidazione guidata dalle scritture
+Labirintoambientale.it
+
+Ogni voce è legata alla "versione dati": un token salvato in
+CACHE_DIR/data_version e rigenerato dopo ogni commit che crea, modifica o
+elimina post (app, cron, webhook, azioni massive, archiviazione). Il file è
+condiviso da worker gunicorn e script cron, quindi una pubblicazione del cron
+invalida subito le pagine di tutti i worker.
+
+Livelli:
+- LRU in memoria per processo (PAGE_CACHE_SIZE voci, scadenza PAGE_CACHE_TTL)
+- opzionale, copia su file in CACHE_DIR/pages/<versione>/ condivisa tra
+  i worker (PAGE_CACHE_SHARED)
+"""
+import hashlib
+import itertools
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import metrics
+from models import Post
+
+# Modelli mostrati dalle pagine in cache: scriverli cambia la versione dati
+TRACKED_MODELS = (Post,)
+
+
+class DataVersion:
+    """Token di versione dei dati condiviso tra processi tramite file"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._stat = None
+        self._value = '0'
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        Versione corrente (rilegge il file solo se è cambiato)
+
+        Returns:
+            str: Token di versione ('0' se mai scritto)
+        """
+        if not self.path:
+            return self._value
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return '0'
+        # os.replace crea un nuovo inode: (inode, mtime) cambia a ogni bump
+        signature = (st.st_ino, st.st_mtime_ns)
+        if signature != self._stat:
+            with self._lock:
+                try:
+                    with open(self.path) as f:
+                        self._value = f.read().strip() or '0'
+                    self._stat = signature
+                except FileNotFoundError:
+                    return '0'
+        return self._value
+
+    def bump(self):
+        """Genera una nuova versione (scrittura atomica)"""
+        token = f'{time.time_ns():x}-{os.getpid()}'
+        if not self.path:
+            self._value = token
+            return token
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                f.write(token)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️  Impossibile aggiornare versione cache: {e}")
+        return token
+
+
+class PageCache:
+    """LRU in memoria con copia opzionale su file, indicizzata per versione dati"""
+
+    def __init__(self, maxsize=128, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = True
+        self.version = DataVersion()
+        self.shared_dir = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, cache_dir, maxsize=128, ttl=300, shared=False, enabled=True):
+        """
+        Imposta directory, dimensione e scadenza
+
+        Args:
+            cache_dir (str): Directory per versione dati e copia condivisa
+            maxsize (int): Voci massime in memoria
+            ttl (int): Secondi di validità di una voce
+            shared (bool): Abilita la copia su file tra processi
+            enabled (bool): False = nessuna pagina servita dalla cache
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self.version.path = os.path.join(cache_dir, 'data_version')
+        self.shared_dir = os.path.join(cache_dir, 'pages') if shared else None
+        self.clear()
+
+    def clear(self):
+        """Svuota la LRU del processo"""
+        with self._lock:
+            self._entries.clear()
+
+    def _shared_path(self, version, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.shared_dir, version, f'{digest}.html')
+
+    def get(self, key):
+        """
+        Valore in cache per la versione dati corrente
+
+        Returns:
+            str: Valore oppure None se assente, scaduto o di una versione precedente
+        """
+        version = self.version.current()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, value = entry
+                if entry_version == version and expires_at > now:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        if not self.shared_dir:
+            return None
+        path = self._shared_path(version, key)
+        try:
+            if os.path.getmtime(path) + self.ttl <= now:
+                return None
+            with open(path, encoding='utf-8') as f:
+                value = f.read()
+        except OSError:
+            return None
+        self._remember(key, version, value, now)
+        return value
+
+    def set(self, key, value, version):
+        """
+        Salva un valore calcolato con i dati della versione indicata
+
+        La versione va letta PRIMA di interrogare il database: se nel frattempo
+        arriva una scrittura, la voce resta legata alla versione vecchia.
+        """
+        now = time.time()
+        self._remember(key, version, value, now)
+        if self.shared_dir:
+            self._write_shared(key, version, value)
+
+    def _remember(self, key, version, value, now):
+        with self._lock:
+            self._entries[key] = (version, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _write_shared(self, key, version, value):
+        """Scrive la copia su file ed elimina le directory di versioni superate"""
+        version_dir = os.path.join(self.shared_dir, version)
+        try:
+            if not os.path.isdir(version_dir):
+                os.makedirs(version_dir, exist_ok=True)
+                for name in os.listdir(self.shared_dir):
+                    if name != version:
+                        shutil.rmtree(os.path.join(self.shared_dir, name), ignore_errors=True)
+            path = self._shared_path(version, key)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  Impossibile salvare pagina in cache: {e}")
+
+
+page_cache = PageCache()
+
+
+_hook_ids = itertools.count()
+
+
+def track_model_writes(models, on_commit):
+    """
+    Chiama on_commit() dopo ogni commit che ha scritto uno dei modelli indicati
+
+    Intercetta sia il flush degli oggetti ORM sia gli UPDATE/DELETE massivi
+    (Query.update / Query.delete). Un rollback annulla la segnalazione.
+    Usato per la versione dati delle pagine e per quella degli account
+    (accounts.py); ogni coppia modelli/callback va registrata una sola volta.
+
+    Args:
+        models (tuple): Classi dei modelli osservati
+        on_commit (callable): Funzione senza argomenti
+    """
+    key = ('model_writes', next(_hook_ids))
+
+    def touches(objects):
+        return any(isinstance(obj, models) for obj in objects)
+
+    @event.listens_for(Session, 'after_flush')
+    def _after_flush(session, flush_context):
+        dirty = (obj for obj in session.dirty
+                 if session.is_modified(obj, include_collections=False))
+        if touches(session.new) or touches(session.deleted) or touches(dirty):
+            session.info[key] = True
+
+    @event.listens_for(Session, 'do_orm_execute')
+    def _do_orm_execute(orm_execute_state):
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, models):
+            orm_execute_state.session.info[key] = True
+
+    @event.listens_for(Session, 'after_commit')
+    def _after_commit(session):
+        if session.info.pop(key, False):
+            on_commit()
+
+    @event.listens_for(Session, 'after_rollback')
+    def _after_rollback(session):
+        session.info.pop(key, None)
+
+
+def track_writes():
+    """Registra gli hook che aggiornano la versione dati al commit (TRACKED_MODELS)"""
+    if getattr(track_writes, '_installed', False):
+        return
+    track_writes._installed = True
+    track_model_writes(TRACKED_MODELS, page_cache.version.bump)
+
+
+def init_app(app):
+    """Configura la cache dalla config dell'app e attiva il tracciamento scritture"""
+    page_cache.configure(app.config['CACHE_DIR'],
+                         maxsize=app.config['PAGE_CACHE_SIZE'],
+                         ttl=app.config['PAGE_CACHE_TTL'],
+                         shared=app.config['PAGE_CACHE_SHARED'],
+                         enabled=app.config['PAGE_CACHE'])
+    track_writes()
+
+
+def cached_page(view):
+    """
+    Decoratore: serve la pagina HTML dalla cache se la versione dati non è cambiata
+
+    Chiave = percorso completo con query string. Le richieste con messaggi
+    flash in sospeso vengono renderizzate senza cache (il messaggio fa parte
+    della pagina).
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not page_cache.enabled or request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        key = f'page:{request.full_path}'
+        version = page_cache.version.current()
+        html = page_cache.get(key)
+        if html is not None:
+            metrics.inc('page_cache_requests_total', route=request.endpoint, result='hit')
+            return html
+
+        metrics.inc('page_cache_requests_total', route=request.endpoint, result='miss')
+        response = view(*args, **kwargs)
+        if isinstance(response, str):
+            page_cache.set(key, response, version)
+        return response
+    return wrapper
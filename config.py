@@ -21,6 +21,27 @@ class Config:
     # Ottieni la tua API key da: https://getlate.dev/dashboard/settings/api
     LATE_API_KEY = os.environ.get('LATE_API_KEY') or 'your_late_api_key_here'
     LATE_API_URL = 'https://api.getlate.dev/v1'
+    LATE_API_TIMEOUT = float(os.environ.get('LATE_API_TIMEOUT') or 30)  # secondi
+    
+    # Thread per processo dedicati ai job di pubblicazione in background
+    PUBLISH_WORKERS = int(os.environ.get('PUBLISH_WORKERS') or 2)
+    # Job 'queued'/'running' più vecchio di così = processo morto: non blocca nuovi job
+    PUBLISH_JOB_TIMEOUT = int(os.environ.get('PUBLISH_JOB_TIMEOUT') or 600)  # secondi
+    
+    # Outbox consegne per piattaforma: retry con backoff esponenziale
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS') or 5)
+    OUTBOX_BACKOFF_BASE = int(os.environ.get('OUTBOX_BACKOFF_BASE') or 60)  # secondi
+    OUTBOX_BACKOFF_MAX = int(os.environ.get('OUTBOX_BACKOFF_MAX') or 6 * 3600)  # secondi
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE') or 50)
+    OUTBOX_LEASE_SECONDS = 600  # Invio considerato interrotto dopo 10 minuti
+    
+    # Modalità hand-off: i post vengono programmati direttamente sullo scheduler
+    # LATE alla creazione/modifica; il cron si limita a riconciliare lo stato
+    LATE_HANDOFF = os.environ.get('LATE_HANDOFF', '').lower() in ('1', 'true', 'yes')
+    
+    # Webhook LATE: segreto condiviso per la firma HMAC-SHA256 delle callback
+    LATE_WEBHOOK_SECRET = os.environ.get('LATE_WEBHOOK_SECRET') or ''
+    LATE_WEBHOOK_SIGNATURE_HEADER = 'X-Late-Signature'
     
     # Account IDs per ogni piattaforma (li ottieni dopo aver connesso gli account su LATE)
     # Dashboard LATE → Accounts → copia gli ID
@@ -40,9 +61,42 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov'}
     
+    # Rotta /media: cache dei file con nome = hash del contenuto (immutabili)
+    # e dei vecchi upload con nome libero
+    MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE') or 365 * 24 * 3600)  # secondi
+    MEDIA_LEGACY_MAX_AGE = int(os.environ.get('MEDIA_LEGACY_MAX_AGE') or 3600)  # secondi
+    # Invio dei file delegato al web server: '' (worker), 'x-sendfile'
+    # (Apache/lighttpd) oppure 'x-accel-redirect' (nginx, location internal
+    # MEDIA_ACCEL_PREFIX che punta a UPLOAD_FOLDER)
+    MEDIA_SENDFILE = (os.environ.get('MEDIA_SENDFILE') or '').lower()
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX') or '/_uploads/'
+    
+    # Retention: post pubblicati/falliti più vecchi di N giorni vanno in archivio
+    # compresso e il database viene compattato (0 = disattivata, default;
+    # es. RETENTION_DAYS=180 per attivarla dallo script cron)
+    RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS') or 0)
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(BASE_DIR, 'data', 'archive')
+    
     # Timezone
     TIMEZONE = 'Europe/Rome'
     
+    # Metriche Prometheus: directory condivisa tra worker gunicorn e script cron
+    METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(BASE_DIR, 'data', 'metrics')
+    
+    # Profilazione SQL per richiesta (disattivata di default)
+    SQL_PROFILING = os.environ.get('SQL_PROFILING', '').lower() in ('1', 'true', 'yes')
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG') or os.path.join(BASE_DIR, 'data', 'slow_queries.log')
+
+    # Cache pagine (dashboard, lista post, calendario): invalidata dalla
+    # versione dati in CACHE_DIR, aggiornata a ogni scrittura sui post
+    PAGE_CACHE = os.environ.get('PAGE_CACHE', '1').lower() in ('1', 'true', 'yes')
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE') or 128)  # pagine per processo
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL') or 300)  # secondi
+    # Copia su file condivisa tra i worker gunicorn (oltre alla LRU in memoria)
+    PAGE_CACHE_SHARED = os.environ.get('PAGE_CACHE_SHARED', '').lower() in ('1', 'true', 'yes')
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(BASE_DIR, 'data', 'cache')
+
     # Configurazione post
     MAX_POST_LENGTH = {
         'twitter': 280,
@@ -127,7 +181,27 @@ Supporto per implementazione e consulenza su labirintoambientale.it
         'saturday': ['11:00', '17:00'],
         'sunday': ['11:00', '17:00']
     }
-    
+
+    # Assegnazione automatica degli orari: distanza minima tra due post
+    # sulla stessa piattaforma (minuti) e giorni massimi in avanti
+    MIN_POST_SPACING_MINUTES = {
+        'facebook': 180,
+        'instagram': 180,
+        'linkedin': 240,
+        'twitter': 60,
+        'pinterest': 120
+    }
+    AUTO_SCHEDULE_HORIZON_DAYS = int(os.environ.get('AUTO_SCHEDULE_HORIZON_DAYS') or 60)
+
+    # Serie ricorrenti: giorni in avanti per cui esistono già i post concreti
+    SERIES_WINDOW_DAYS = int(os.environ.get('SERIES_WINDOW_DAYS') or 14)
+
+    # Quasi-duplicati: post con somiglianza stimata >= soglia (0-1) programmati
+    # entro N giorni prima o dopo vengono segnalati alla creazione
+    DUPLICATE_CHECK = os.environ.get('DUPLICATE_CHECK', '1').lower() in ('1', 'true', 'yes')
+    DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD') or 0.8)
+    DUPLICATE_WINDOW_DAYS = int(os.environ.get('DUPLICATE_WINDOW_DAYS') or 14)
+
     # Hashtag strategici per labirintoambientale.it
     STRATEGIC_HASHTAGS = {
         'generale': ['#gestionerifiuti', '#ambiente', '#sostenibilità', '#economiacircolare'],
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Rilevamento di post quasi duplicati con firme MinHash e bucket LSH
+Labirintoambientale.it
+
+Ogni post ha una firma MinHash del suo contenuto (shingle di 3 parole),
+salvata insieme ai bucket LSH delle sue bande (hook SQLAlchemy al
+salvataggio). Un nuovo testo viene confrontato solo con i post che
+condividono almeno un bucket e sono programmati nella finestra temporale:
+una query sull'indice (band, bucket) invece di un confronto con tutti i testi.
+"""
+import random
+import re
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, or_
+
+from config import Config
+import post_hooks
+from models import db, Post, ContentSignature, ContentBucket
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS  # Coppie con somiglianza 0.8 condividono un bucket al 99.9%
+SHINGLE_SIZE = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x1AB1)  # Permutazioni fisse: le firme salvate restano confrontabili
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_WORD_RE = re.compile(r'\w+')
+_URL_RE = re.compile(r'https?://\S+')
+
+# Relazioni di Post caricate durante la reindicizzazione
+_RELATIONSHIPS = ('content_buckets', 'content_signature')
+
+
+def shingles(content):
+    """
+    Insieme degli shingle (hash di 3 parole consecutive) del testo
+
+    Maiuscole, punteggiatura, emoji e link non contano.
+    """
+    words = _WORD_RE.findall(_URL_RE.sub(' ', (content or '').lower()))
+    if not words:
+        return set()
+    if len(words) < SHINGLE_SIZE:
+        return {zlib.crc32(' '.join(words).encode('utf-8'))}
+    return {zlib.crc32(' '.join(words[i:i + SHINGLE_SIZE]).encode('utf-8'))
+            for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def signature(content):
+    """
+    Firma MinHash del testo
+
+    Returns:
+        array: NUM_PERM valori uint32, oppure None se il testo non ha parole
+    """
+    hashes = shingles(content)
+    if not hashes:
+        return None
+    return array('I', (min((a * x + b) % _PRIME for x in hashes) & 0xFFFFFFFF
+                       for a, b in _PERMUTATIONS))
+
+
+def band_buckets(sig):
+    """Bucket LSH (band, bucket) della firma; bucket = hash a 63 bit delle righe della banda"""
+    buckets = []
+    for band in range(BANDS):
+        rows = sig[band * ROWS:(band + 1) * ROWS]
+        digest = zlib.crc32(rows.tobytes()) << 31 ^ zlib.adler32(rows.tobytes())
+        buckets.append((band, digest & 0x7FFFFFFFFFFFFFFF))
+    return buckets
+
+
+def similarity(sig_a, sig_b):
+    """Somiglianza di Jaccard stimata tra due firme (0-1)"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _from_bytes(data):
+    sig = array('I')
+    sig.frombytes(data)
+    return sig
+
+
+def sync_post(post):
+    """Allinea firma e bucket LSH al contenuto del post (solo differenze)"""
+    sig = signature(post.content)
+    if sig is None:
+        post.content_signature = None
+        post.content_buckets = []
+        return
+
+    if post.content_signature is None:
+        post.content_signature = ContentSignature(signature=sig.tobytes(),
+                                                  scheduled_date=post.scheduled_date)
+    else:
+        post.content_signature.signature = sig.tobytes()
+        post.content_signature.scheduled_date = post.scheduled_date
+
+    wanted = set(band_buckets(sig))
+    for row in list(post.content_buckets):
+        if (row.band, row.bucket) in wanted:
+            wanted.discard((row.band, row.bucket))
+        else:
+            post.content_buckets.remove(row)
+    for band, bucket in sorted(wanted):
+        post.content_buckets.append(ContentBucket(band=band, bucket=bucket))
+
+
+def track_signatures():
+    """Aggiorna le firme dei post nuovi o modificati (hook condiviso in post_hooks)"""
+    post_hooks.register(sync_post)
+
+
+def find_similar(content, scheduled_date=None, exclude_id=None, threshold=None, window_days=None):
+    """
+    Post programmati vicino a scheduled_date con contenuto quasi uguale
+
+    Args:
+        content (str): Testo da verificare
+        scheduled_date (datetime): Data UTC naive del nuovo post (default adesso)
+        exclude_id (int): Post da escludere (es. quello in modifica)
+        threshold (float): Somiglianza minima 0-1 (default DUPLICATE_THRESHOLD)
+        window_days (int): Giorni prima/dopo (default DUPLICATE_WINDOW_DAYS)
+
+    Returns:
+        list: [{'post_id', 'similarity', 'scheduled_date', 'status'}] per
+            somiglianza decrescente
+    """
+    sig = signature(content)
+    if sig is None:
+        return []
+    threshold = Config.DUPLICATE_THRESHOLD if threshold is None else threshold
+    window = timedelta(days=Config.DUPLICATE_WINDOW_DAYS if window_days is None else window_days)
+    scheduled_date = scheduled_date or datetime.utcnow()
+
+    query = db.session.query(ContentSignature.post_id, ContentSignature.signature,
+                             ContentSignature.scheduled_date, Post.status) \
+        .join(ContentBucket, ContentBucket.post_id == ContentSignature.post_id) \
+        .join(Post, Post.id == ContentSignature.post_id) \
+        .filter(or_(*[and_(ContentBucket.band == band, ContentBucket.bucket == bucket)
+                      for band, bucket in band_buckets(sig)])) \
+        .filter(ContentSignature.scheduled_date >= scheduled_date - window,
+                ContentSignature.scheduled_date <= scheduled_date + window,
+                Post.status != 'failed') \
+        .distinct()
+    if exclude_id:
+        query = query.filter(ContentSignature.post_id != exclude_id)
+
+    matches = []
+    for post_id, data, date, status in query:
+        score = similarity(sig, _from_bytes(data))
+        if score >= threshold:
+            matches.append({'post_id': post_id, 'similarity': round(score, 2),
+                            'scheduled_date': date.isoformat(), 'status': status})
+    return sorted(matches, key=lambda m: -m['similarity'])
+
+
+def reindex_posts(batch_size=500):
+    """
+    Ricalcola firme e bucket di tutti i post (commit a blocchi)
+
+    Returns:
+        int: Post elaborati
+    """
+    return post_hooks.reindex(sync_post, _RELATIONSHIPS, batch_size)
+
+
+def ensure_index():
+    """Calcola le firme se la tabella è vuota (primo init-db dopo l'aggiornamento)"""
+    processed = post_hooks.ensure_index(ContentSignature.post_id, sync_post, _RELATIONSHIPS)
+    if processed:
+        print(f"🧬 Firme contenuto calcolate per {processed} post")
+
+
+@click.command('duplicates-reindex')
+@with_appcontext
+def reindex_command():
+    """Ricalcola le firme anti-duplicato di tutti i post"""
+    processed = reindex_posts()
+    click.echo(f"✅ Firme calcolate per {processed} post")
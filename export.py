@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Export in streaming di post e storico pubblicazioni (CSV / NDJSON)
+Labirintoambientale.it
+
+Le righe vengono lette dal database a blocchi (stream_results + yield_per)
+e serializzate una alla volta da generatori: la memoria usata non dipende
+dalla dimensione del database.
+"""
+import csv
+import io
+import json
+import sys
+
+import click
+from flask.cli import with_appcontext
+
+from models import db, Post, PublicationLog
+from post_filters import apply_post_filters
+
+FORMATS = ('csv', 'ndjson')
+DATASETS = ('posts', 'history')
+
+# Righe lette dal cursore per ogni blocco
+CHUNK_SIZE = 1000
+
+# Dimensione indicativa dei blocchi inviati al client
+FLUSH_BYTES = 64 * 1024
+
+POST_FIELDS = ['id', 'content', 'platforms', 'image_url', 'video_url', 'scheduled_date',
+               'status', 'published_at', 'late_post_id', 'template_name', 'notes', 'created_at']
+
+HISTORY_FIELDS = ['log_id', 'post_id', 'platform', 'status', 'error_message', 'published_url',
+                  'attempted_at', 'post_status', 'post_scheduled_date', 'post_template_name',
+                  'post_content']
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _stream(query):
+    """Esegue la query leggendo il cursore a blocchi"""
+    return query.execution_options(stream_results=True, yield_per=CHUNK_SIZE)
+
+
+def _post_rows(query):
+    for row in _stream(query):
+        item = dict(zip(POST_FIELDS, row))
+        item['platforms'] = [p.strip() for p in (item['platforms'] or '').split(',') if p.strip()]
+        for key in ('scheduled_date', 'published_at', 'created_at'):
+            item[key] = _isoformat(item[key])
+        yield item
+
+
+def iter_posts(filters=None):
+    """
+    Righe equivalenti a Post.to_dict() senza caricare oggetti ORM
+
+    I filtri vengono validati subito (FilterError), prima che parta lo streaming.
+
+    Args:
+        filters (dict): status, platform, date_from, date_to (su scheduled_date)
+    """
+    columns = [getattr(Post, name) for name in POST_FIELDS]
+    query = apply_post_filters(db.session.query(*columns), filters or {})
+    return _post_rows(query.order_by(Post.id.asc()))
+
+
+def _history_rows(query):
+    for row in _stream(query):
+        item = dict(zip(HISTORY_FIELDS, row))
+        item['attempted_at'] = _isoformat(item['attempted_at'])
+        item['post_scheduled_date'] = _isoformat(item['post_scheduled_date'])
+        yield item
+
+
+def iter_history(filters=None):
+    """
+    Storico PublicationLog unito ai dati del post
+
+    Args:
+        filters (dict): status (del post), platform, date_from, date_to (su attempted_at)
+    """
+    filters = dict(filters or {})
+    log_platform = filters.pop('platform', None)
+    query = db.session.query(
+        PublicationLog.id, PublicationLog.post_id, PublicationLog.platform,
+        PublicationLog.status, PublicationLog.error_message, PublicationLog.published_url,
+        PublicationLog.attempted_at, Post.status, Post.scheduled_date,
+        Post.template_name, Post.content
+    ).join(Post, Post.id == PublicationLog.post_id)
+    query = apply_post_filters(query, filters, date_column=PublicationLog.attempted_at)
+    if log_platform:
+        query = query.filter(PublicationLog.platform == log_platform)
+    return _history_rows(query.order_by(PublicationLog.id.asc()))
+
+
+def to_ndjson(rows):
+    """Una riga JSON per record, emessa a blocchi di circa FLUSH_BYTES"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def to_csv(rows, fieldnames):
+    """CSV con intestazione, emesso a blocchi di circa FLUSH_BYTES"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    for row in rows:
+        if isinstance(row.get('platforms'), list):
+            row['platforms'] = ','.join(row['platforms'])
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def generate_export(dataset, fmt, filters=None):
+    """
+    Generatore del contenuto dell'export
+
+    Args:
+        dataset (str): 'posts' o 'history'
+        fmt (str): 'csv' o 'ndjson'
+        filters (dict): Filtri status/platform/date_from/date_to
+
+    Returns:
+        generator: Blocchi di testo
+    """
+    if dataset == 'posts':
+        rows, fields = iter_posts(filters), POST_FIELDS
+    else:
+        rows, fields = iter_history(filters), HISTORY_FIELDS
+    return to_csv(rows, fields) if fmt == 'csv' else to_ndjson(rows)
+
+
+@click.command('export')
+@click.argument('dataset', type=click.Choice(DATASETS))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='csv', show_default=True)
+@click.option('--status', help='Filtra per stato del post')
+@click.option('--platform', help='Filtra per piattaforma')
+@click.option('--date-from', help='Dal giorno YYYY-MM-DD (ora di Roma)')
+@click.option('--date-to', help='Al giorno YYYY-MM-DD incluso (ora di Roma)')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='File di destinazione (default stdout)')
+@with_appcontext
+def export_command(dataset, fmt, status, platform, date_from, date_to, output):
+    """Esporta post o storico pubblicazioni in CSV/NDJSON"""
+    filters = {'status': status, 'platform': platform, 'date_from': date_from, 'date_to': date_to}
+    out = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    try:
+        for chunk in generate_export(dataset, fmt, filters):
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
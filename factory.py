@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Costruzione leggera dell'applicazione Flask
+Labirintoambientale.it
+
+create_db_app() crea solo configurazione e database: la usano lo script
+cron e i comandi CLI che non servono pagine web. Il client LATE viene
+creato al primo utilizzo e lo schema non viene più verificato all'avvio di
+ogni processo, ma creato con il comando esplicito `flask --app app init-db`.
+"""
+import os
+
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+
+import accounts
+import cache
+import duplicates
+import hashtags
+from models import db
+from config import Config
+
+
+def create_db_app(config_object=Config):
+    """
+    Crea un'app Flask con sola configurazione e database
+
+    Args:
+        config_object: Classe o oggetto di configurazione
+
+    Returns:
+        Flask: Applicazione pronta per app_context()
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    db.init_app(app)
+
+    # Versione dati per la cache pagine: aggiornata da ogni processo che scrive
+    cache.init_app(app)
+    
+    # Account social letti da account_settings, ricaricati al cambio di versione
+    accounts.init_app(app)
+    
+    # Indice hashtag aggiornato a ogni salvataggio dei post
+    hashtags.track_hashtags()
+    
+    # Firme anti-duplicato aggiornate a ogni salvataggio dei post
+    duplicates.track_signatures()
+
+    # Directory necessarie (solo controlli sul filesystem, nessuna query)
+    os.makedirs(os.path.join(app.config['BASE_DIR'], 'data'), exist_ok=True)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    return app
+
+
+def get_late_api(app=None):
+    """
+    Client LATE dell'app, creato al primo utilizzo
+
+    Args:
+        app (Flask): Applicazione (default current_app)
+
+    Returns:
+        LateAPI: Client condiviso dal processo
+    """
+    app = app or current_app._get_current_object()
+    late_api = app.extensions.get('late_api')
+    if late_api is None:
+        # late_api importa requests (decine di ms): nessun modulo lo importa a livello
+        # di file, così cron e comandi CLI che non chiamano LATE non lo caricano
+        from late_api import LateAPI
+        late_api = LateAPI(app.config['LATE_API_KEY'],
+                           app.config['LATE_API_URL'],
+                           timeout=app.config['LATE_API_TIMEOUT'])
+        app.extensions['late_api'] = late_api
+    return late_api
+
+
+def init_schema():
+    """Crea tabelle, indici mancanti e indici derivati dai post (idempotente)"""
+    import search
+
+    db.create_all()
+    # create_all() non tocca le tabelle esistenti: aggiunge gli indici nuovi
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    search.create_index()
+    hashtags.ensure_index()
+    duplicates.ensure_index()
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Crea o aggiorna lo schema del database"""
+    init_schema()
+    click.echo("✅ Database inizializzato")
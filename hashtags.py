@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Indice degli hashtag usati nei post e suggerimenti per l'editor
+Labirintoambientale.it
+
+Gli hashtag vengono estratti con extract_hashtags() a ogni salvataggio di un
+post (hook SQLAlchemy: app, cron, serie ricorrenti) e salvati in
+post_hashtags, normalizzati in minuscolo. Conteggi e ricerche per prefisso
+sono query SQL sull'indice (tag, used_at); gli hashtag strategici di
+Config.STRATEGIC_HASHTAGS sono tenuti in una lista ordinata in memoria.
+"""
+from bisect import bisect_left
+from datetime import timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import case, desc, func
+
+from config import Config
+import post_hooks
+from models import db, Post, PostHashtag
+from post_filters import rome_to_utc
+
+# Carattere massimo Unicode: tag >= p AND tag < p + MAX_CHAR = "inizia con p"
+MAX_CHAR = '\U0010ffff'
+
+# Relazioni di Post caricate durante la reindicizzazione
+_RELATIONSHIPS = ('hashtag_rows',)
+
+_strategic = None
+
+
+def normalize(label):
+    """'#GestioneRifiuti' -> 'gestionerifiuti'"""
+    return label.lstrip('#').strip().lower()[:100]
+
+
+def sync_post(post):
+    """
+    Allinea le righe post_hashtags al contenuto del post
+
+    Aggiorna solo le differenze (niente cancella-e-reinserisci), così il
+    vincolo unico (post_id, tag) non viene mai violato durante il flush.
+    """
+    from late_api import extract_hashtags
+
+    labels = {}
+    for label in extract_hashtags(post.content or ''):
+        tag = normalize(label)
+        if tag:
+            labels.setdefault(tag, label[:100])
+
+    existing = {row.tag: row for row in post.hashtag_rows}
+    for tag, row in existing.items():
+        if tag not in labels:
+            post.hashtag_rows.remove(row)
+        else:
+            row.label = labels[tag]
+            row.used_at = post.scheduled_date
+    for tag, label in labels.items():
+        if tag not in existing:
+            post.hashtag_rows.append(PostHashtag(tag=tag, label=label, used_at=post.scheduled_date))
+
+
+def track_hashtags():
+    """Indicizza gli hashtag dei post nuovi o modificati (hook condiviso in post_hooks)"""
+    post_hooks.register(sync_post)
+
+
+def reindex_posts(batch_size=500):
+    """
+    Ricostruisce l'indice per tutti i post (commit a blocchi)
+
+    Returns:
+        int: Post elaborati
+    """
+    return post_hooks.reindex(sync_post, _RELATIONSHIPS, batch_size)
+
+
+def ensure_index():
+    """Popola l'indice se la tabella è vuota (primo init-db dopo l'aggiornamento)"""
+    processed = post_hooks.ensure_index(PostHashtag.id, sync_post, _RELATIONSHIPS)
+    if processed:
+        print(f"🏷️  Hashtag indicizzati per {processed} post")
+
+
+def strategic_index():
+    """
+    Hashtag strategici ordinati per tag normalizzato
+
+    Returns:
+        list: Tuple (tag, label, categoria), una per tag
+    """
+    global _strategic
+    if _strategic is None:
+        entries = {}
+        for category, labels in Config.STRATEGIC_HASHTAGS.items():
+            for label in labels:
+                entries.setdefault(normalize(label), (normalize(label), label, category))
+        _strategic = sorted(entries.values())
+    return _strategic
+
+
+def _strategic_matches(prefix):
+    """Hashtag strategici che iniziano con prefix (ricerca binaria)"""
+    index = strategic_index()
+    keys = [entry[0] for entry in index]
+    start = bisect_left(keys, prefix)
+    end = bisect_left(keys, prefix + MAX_CHAR)
+    return index[start:end]
+
+
+def _prefix_filter(query, prefix):
+    if prefix:
+        query = query.filter(PostHashtag.tag >= prefix, PostHashtag.tag < prefix + MAX_CHAR)
+    return query
+
+
+def suggest(prefix='', limit=10):
+    """
+    Suggerimenti per l'editor: strategici e più usati che iniziano con prefix
+
+    Ordine: utilizzi storici decrescenti, a parità prima gli strategici.
+
+    Args:
+        prefix (str): Inizio dell'hashtag (con o senza '#')
+        limit (int): Numero massimo di suggerimenti (max 50)
+
+    Returns:
+        list: [{'tag': '#...', 'uses': int, 'strategic': bool, 'category': str|None}]
+    """
+    prefix = normalize(prefix or '')
+    limit = min(max(int(limit), 1), 50)
+
+    uses = func.count(PostHashtag.id).label('uses')
+    query = _prefix_filter(db.session.query(PostHashtag.tag, func.max(PostHashtag.label), uses), prefix)
+    query = query.group_by(PostHashtag.tag).order_by(desc(uses)).limit(limit)
+
+    suggestions = {}
+    for tag, label, count in query:
+        suggestions[tag] = {'tag': label, 'uses': count, 'strategic': False, 'category': None}
+    for tag, label, category in _strategic_matches(prefix):
+        item = suggestions.setdefault(tag, {'tag': label, 'uses': 0})
+        item.update({'tag': label, 'strategic': True, 'category': category})
+
+    ranked = sorted(suggestions.items(), key=lambda kv: (-kv[1]['uses'], not kv[1]['strategic'], kv[0]))
+    return [item for _, item in ranked[:limit]]
+
+
+def hashtag_stats(date_from=None, date_to=None, limit=50):
+    """
+    Conteggi per hashtag calcolati in SQL
+
+    Args:
+        date_from (str): Dal giorno YYYY-MM-DD (ora di Roma, data del post)
+        date_to (str): Al giorno YYYY-MM-DD incluso
+        limit (int): Numero massimo di hashtag (max 500)
+
+    Returns:
+        list: [{'tag', 'uses', 'published', 'failed', 'last_used'}] per utilizzi
+            decrescenti; published/failed contano i post non ancora archiviati
+    """
+    limit = min(max(int(limit), 1), 500)
+    uses = func.count(PostHashtag.id).label('uses')
+    query = db.session.query(
+        PostHashtag.tag,
+        func.max(PostHashtag.label),
+        uses,
+        func.sum(case((Post.status == 'published', 1), else_=0)),
+        func.sum(case((Post.status == 'failed', 1), else_=0)),
+        func.max(PostHashtag.used_at)
+    ).outerjoin(Post, Post.id == PostHashtag.post_id)
+
+    if date_from:
+        query = query.filter(PostHashtag.used_at >= rome_to_utc(date_from))
+    if date_to:
+        query = query.filter(PostHashtag.used_at < rome_to_utc(date_to) + timedelta(days=1))
+
+    rows = query.group_by(PostHashtag.tag).order_by(desc(uses), PostHashtag.tag).limit(limit)
+    return [{
+        'tag': label,
+        'uses': count,
+        'published': published or 0,
+        'failed': failed or 0,
+        'last_used': last_used.isoformat() if last_used else None
+    } for tag, label, count, published, failed, last_used in rows]
+
+
+@click.command('hashtags-reindex')
+@with_appcontext
+def reindex_command():
+    """Ricostruisce l'indice hashtag da tutti i post"""
+    processed = reindex_posts()
+    click.echo(f"✅ Hashtag indicizzati per {processed} post")
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Esecuzione in background dei job di pubblicazione
+Labirintoambientale.it
+
+Le richieste web accodano un PublishJob e rispondono subito; un pool di
+thread per processo esegue publish_post() fuori dal ciclo della richiesta.
+Lo stato del job vive nel database, quindi qualsiasi worker gunicorn può
+rispondere al polling.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from models import db, Post, PublishJob
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class JobRunner:
+    """Pool di thread che esegue i PublishJob con un app context dedicato"""
+
+    def __init__(self, app=None, max_workers=2):
+        self.app = app
+        self.max_workers = max_workers
+        self._executor = None
+
+    def init_app(self, app):
+        """Collega runner e app"""
+        self.app = app
+        self.max_workers = app.config.get('PUBLISH_WORKERS', self.max_workers)
+
+    @property
+    def late_api(self):
+        """Client LATE dell'app, creato al primo job"""
+        from factory import get_late_api
+        return get_late_api(self.app)
+
+    @property
+    def executor(self):
+        # Creato alla prima richiesta: i thread non sopravvivono al fork di gunicorn
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='publish-job')
+        return self._executor
+
+    def enqueue(self, post):
+        """
+        Accoda la pubblicazione di un post
+
+        Args:
+            post (Post): Post da pubblicare
+
+        Returns:
+            tuple: (job, created) - created è False se esisteva già un job attivo
+        """
+        self.expire_stale(post.id)
+        existing = PublishJob.query.filter(
+            PublishJob.post_id == post.id,
+            PublishJob.status.in_(ACTIVE_STATUSES)
+        ).first()
+        if existing:
+            return existing, False
+
+        job, = self.create_jobs([post])
+        db.session.commit()
+
+        self.submit_jobs([job])
+        return job, True
+
+    def expire_stale(self, post_id=None):
+        """
+        Segna 'failed' i job attivi più vecchi di PUBLISH_JOB_TIMEOUT (senza commit)
+
+        Un job resta 'queued' o 'running' per sempre se il processo che lo
+        eseguiva muore o viene riavviato: senza scadenza bloccherebbe ogni
+        nuovo "Pubblica Ora" del post. Le consegne già in invio sono
+        protette dal lease dell'outbox, quindi un nuovo job non le duplica.
+
+        Args:
+            post_id (int): Solo i job di questo post (default tutti)
+
+        Returns:
+            int: Job scaduti
+        """
+        timeout = self.app.config.get('PUBLISH_JOB_TIMEOUT', 600) if self.app else 600
+        now = datetime.utcnow()
+        query = PublishJob.query.filter(
+            PublishJob.status.in_(ACTIVE_STATUSES),
+            db.func.coalesce(PublishJob.started_at, PublishJob.created_at) < now - timedelta(seconds=timeout)
+        )
+        if post_id is not None:
+            query = query.filter(PublishJob.post_id == post_id)
+        return query.update({
+            'status': 'failed',
+            'error_message': 'Job interrotto (processo terminato), scaduto dopo il timeout',
+            'finished_at': now
+        }, synchronize_session=False)
+
+    def create_jobs(self, posts):
+        """
+        Aggiunge alla sessione un job 'queued' per ogni post (senza commit)
+
+        Returns:
+            list: PublishJob con id già assegnato
+        """
+        jobs = [PublishJob(post_id=post.id, status='queued') for post in posts]
+        db.session.add_all(jobs)
+        db.session.flush()
+        return jobs
+
+    def submit_jobs(self, jobs):
+        """
+        Avvia nel pool i job già salvati
+
+        Returns:
+            list: Future dei job sottomessi
+        """
+        return [self.executor.submit(self._run, job.id) for job in jobs]
+
+    def submit_handoff(self, post_id):
+        """Programma in background il post sullo scheduler LATE (modalità hand-off)"""
+        return self.executor.submit(self._run_handoff, post_id)
+
+    def _run_handoff(self, post_id):
+        import outbox
+
+        with self.app.app_context():
+            try:
+                post = db.session.get(Post, post_id)
+                if post is not None and post.status == 'scheduled':
+                    outbox.handoff_post(post, self.late_api)
+            except Exception as e:
+                # Le consegne restano in outbox: il cron le riprenderà
+                db.session.rollback()
+                print(f"❌ Eccezione durante hand-off post {post_id}: {e}")
+
+    def _run(self, job_id):
+        """Esegue un job nel thread del pool"""
+        from publish_scheduled_posts import publish_post
+
+        with self.app.app_context():
+            # Passaggio atomico queued -> running: un solo thread esegue il job
+            claimed = PublishJob.query.filter_by(id=job_id, status='queued').update(
+                {'status': 'running', 'started_at': datetime.utcnow()}
+            )
+            db.session.commit()
+            if not claimed:
+                return
+
+            job = db.session.get(PublishJob, job_id)
+            try:
+                post = db.session.get(Post, job.post_id)
+                if post is None or post.status != 'scheduled':
+                    job.status = 'failed'
+                    job.error_message = 'Post già pubblicato o non programmato'
+                elif publish_post(post, self.late_api):
+                    job.status = 'done'
+                else:
+                    job.status = 'failed'
+                    job.error_message = post.error_message
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(PublishJob, job_id)
+                job.status = 'failed'
+                job.error_message = str(e)
+                print(f"❌ Eccezione nel job {job_id}: {e}")
+            finally:
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+
+
+job_runner = JobRunner()
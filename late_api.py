@@ -5,27 +5,56 @@ Labirintoambientale.it
 """
 import requests
 import json
+import time
 from datetime import datetime
 import pytz
 
+import metrics
+
 class LateAPI:
     """Classe per interagire con LATE API"""
     
-    def __init__(self, api_key, api_url='https://api.getlate.dev/v1'):
+    def __init__(self, api_key, api_url='https://api.getlate.dev/v1', timeout=30):
         """
         Inizializza client LATE API
         
         Args:
             api_key (str): API key da LATE dashboard
             api_url (str): Base URL API LATE
+            timeout (float): Timeout in secondi per ogni chiamata HTTP
         """
         self.api_key = api_key
         self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
         self.headers = {
             'Authorization': f'Bearer {api_key}',
             'Content-Type': 'application/json'
         }
     
+    def _request(self, method, url, endpoint_name, **kwargs):
+        """
+        Esegue una chiamata HTTP registrando latenza e status nelle metriche
+        
+        Args:
+            method (str): Metodo HTTP
+            url (str): URL completo
+            endpoint_name (str): Nome logico endpoint per le metriche (es: 'GET /posts/{id}')
+        
+        Returns:
+            requests.Response: Risposta HTTP
+        """
+        status = 'error'
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.perf_counter()
+        try:
+            response = requests.request(method, url, headers=self.headers, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe('late_api_request_duration_seconds',
+                            time.perf_counter() - start,
+                            endpoint=endpoint_name, status=status)
+    
     def create_post(self, content, platforms, account_ids, media_urls=None, 
                    scheduled_time=None, pinterest_config=None):
         """
@@ -89,7 +118,7 @@ class LateAPI:
         
         # Chiamata API
         try:
-            response = requests.post(endpoint, headers=self.headers, json=payload)
+            response = self._request('POST', endpoint, 'POST /posts', json=payload)
             response.raise_for_status()
             return {
                 'success': True,
@@ -97,11 +126,15 @@ class LateAPI:
                 'status_code': response.status_code
             }
         except requests.exceptions.HTTPError as e:
-            error_detail = e.response.json() if e.response.content else str(e)
+            try:
+                error_detail = e.response.json() if e.response.content else str(e)
+            except ValueError:
+                error_detail = e.response.text
             return {
                 'success': False,
                 'error': error_detail,
-                'status_code': e.response.status_code if e.response else None
+                # Response è "falsy" per i 4xx/5xx: serve il confronto con None
+                'status_code': e.response.status_code if e.response is not None else None
             }
         except Exception as e:
             return {
@@ -123,7 +156,7 @@ class LateAPI:
         endpoint = f'{self.api_url}/posts/{post_id}'
         
         try:
-            response = requests.get(endpoint, headers=self.headers)
+            response = self._request('GET', endpoint, 'GET /posts/{id}')
             response.raise_for_status()
             return {
                 'success': True,
@@ -135,6 +168,38 @@ class LateAPI:
                 'error': str(e)
             }
     
+    def list_posts(self, status=None, page=1, limit=100):
+        """
+        Recupera una pagina di post da LATE
+        
+        Args:
+            status (str): Filtra per stato ('scheduled', 'published', 'failed')
+            page (int): Numero pagina (da 1)
+            limit (int): Post per pagina
+        
+        Returns:
+            dict: Lista post della pagina
+        """
+        endpoint = f'{self.api_url}/posts'
+        params = {'page': page, 'limit': limit}
+        if status:
+            params['status'] = status
+        
+        try:
+            response = self._request('GET', endpoint, 'GET /posts', params=params)
+            response.raise_for_status()
+            data = response.json()
+            posts = data.get('posts', []) if isinstance(data, dict) else data
+            return {
+                'success': True,
+                'posts': posts
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
     def delete_scheduled_post(self, post_id):
         """
         Elimina un post programmato (prima della pubblicazione)
@@ -148,7 +213,7 @@ class LateAPI:
         endpoint = f'{self.api_url}/posts/{post_id}'
         
         try:
-            response = requests.delete(endpoint, headers=self.headers)
+            response = self._request('DELETE', endpoint, 'DELETE /posts/{id}')
             response.raise_for_status()
             return {
                 'success': True,
@@ -170,7 +235,7 @@ class LateAPI:
         endpoint = f'{self.api_url}/accounts'
         
         try:
-            response = requests.get(endpoint, headers=self.headers)
+            response = self._request('GET', endpoint, 'GET /accounts')
             response.raise_for_status()
             return {
                 'success': True,
@@ -195,7 +260,7 @@ class LateAPI:
         endpoint = f'{self.api_url}/posts/{post_id}/analytics'
         
         try:
-            response = requests.get(endpoint, headers=self.headers)
+            response = self._request('GET', endpoint, 'GET /posts/{id}/analytics')
             response.raise_for_status()
             return {
                 'success': True,
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Misura il tempo di avvio a freddo di app web e script cron
+Labirintoambientale.it
+
+Ogni misura gira in un processo Python nuovo (nessun modulo già in cache).
+Con --imports mostra i moduli più lenti da importare (python -X importtime).
+
+Uso: python measure_startup.py [--runs 5] [--imports 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TARGETS = {
+    'web (import app)': 'import app',
+    'cron (setup_app)': 'import publish_scheduled_posts as p; a = p.setup_app(); a.app_context().push()',
+}
+
+TIMER = 'import time; _t = time.perf_counter(); {code}; print(time.perf_counter() - _t)'
+
+
+def time_target(code, runs):
+    """
+    Tempi di avvio in secondi, uno per processo
+
+    Args:
+        code (str): Codice Python da eseguire
+        runs (int): Numero di processi
+
+    Returns:
+        list: Durate in secondi
+    """
+    durations = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', TIMER.format(code=code)],
+                                cwd=BASE_DIR, capture_output=True, text=True, check=True)
+        durations.append(float(output.stdout.strip().splitlines()[-1]))
+    return durations
+
+
+def slowest_imports(code, limit):
+    """
+    Moduli con il tempo di import cumulativo più alto
+
+    Returns:
+        list: Tuple (microsecondi, modulo)
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=BASE_DIR, capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), module.rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=5, help='Processi per ogni misura')
+    parser.add_argument('--imports', type=int, default=0, help='Mostra i N import più lenti')
+    args = parser.parse_args()
+
+    for name, code in TARGETS.items():
+        durations = time_target(code, args.runs)
+        print(f"⏱️  {name}: mediana {statistics.median(durations) * 1000:.0f} ms "
+              f"(min {min(durations) * 1000:.0f} ms, {args.runs} avvii)")
+        if args.imports:
+            for cumulative, module in slowest_imports(code, args.imports):
+                print(f"   {cumulative / 1000:8.1f} ms  {module}")
+
+
+if __name__ == '__main__':
+    main()
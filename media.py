@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Salvataggio e distribuzione dei media caricati (immagini e video)
+Labirintoambientale.it
+
+I file caricati vengono salvati con il nome derivato dall'hash SHA-256 del
+contenuto (es. 3f2a...c9.jpg): lo stesso URL indica sempre gli stessi byte,
+quindi browser, proxy e LATE possono tenerlo in cache per un anno senza
+ricontrollarlo. La rotta /media/<nome> risponde con ETag, 304 su
+If-None-Match e 206 sulle richieste Range (riproduzione e download dei
+video a blocchi). Con MEDIA_SENDFILE il worker passa l'invio del file al
+web server (X-Sendfile per Apache/lighttpd, X-Accel-Redirect per nginx).
+
+I vecchi URL /static/uploads/<nome> restano validi e sono serviti anche da
+/media/<nome> con una cache breve, perché il nome non identifica il contenuto.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+
+from flask import abort, current_app, request
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename, send_file
+
+VIDEO_EXTENSIONS = {'mp4', 'mov'}
+CHUNK_SIZE = 1024 * 1024
+
+# Nome generato da save_upload(): 64 cifre esadecimali + estensione
+_CONTENT_ADDRESSED_RE = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+
+
+def extension(filename):
+    """'Foto.JPG' -> 'jpg' ('' se assente)"""
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def is_video(filename):
+    """True se il file è un video (mp4/mov)"""
+    return extension(filename) in VIDEO_EXTENSIONS
+
+
+def save_upload(file_storage, upload_folder=None):
+    """
+    Salva un file caricato con nome basato sul contenuto
+
+    Il file viene scritto a blocchi calcolando l'hash, poi rinominato in modo
+    atomico; se esiste già un file identico la copia viene scartata.
+
+    Args:
+        file_storage (FileStorage): File da request.files
+        upload_folder (str): Directory di destinazione (default UPLOAD_FOLDER)
+
+    Returns:
+        str: URL relativo /media/<sha256>.<ext>
+    """
+    upload_folder = upload_folder or current_app.config['UPLOAD_FOLDER']
+    ext = extension(secure_filename(file_storage.filename or ''))
+    digest = hashlib.sha256()
+
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        filename = f'{digest.hexdigest()}.{ext}' if ext else digest.hexdigest()
+        final_path = os.path.join(upload_folder, filename)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return f'/media/{filename}'
+
+
+def _accel_response(path, filename, etag, max_age, immutable):
+    """Risposta vuota con X-Accel-Redirect: il corpo (e i Range) li invia nginx"""
+    stat = os.stat(path)
+    response = current_app.response_class()
+    response.headers['X-Accel-Redirect'] = current_app.config['MEDIA_ACCEL_PREFIX'].rstrip('/') + '/' + filename
+    response.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response.set_etag(etag or f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    response.last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+def serve(filename):
+    """
+    Risposta per /media/<filename>
+
+    Args:
+        filename (str): Nome del file in UPLOAD_FOLDER
+
+    Returns:
+        Response: 200, 206 (Range), 304 (ETag/If-Modified-Since) o 404
+    """
+    config = current_app.config
+    path = safe_join(config['UPLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    match = _CONTENT_ADDRESSED_RE.match(filename)
+    immutable = match is not None
+    # Contenuto indirizzato dall'hash: l'ETag è l'hash stesso
+    etag = match.group(1) if immutable else None
+    max_age = config['MEDIA_MAX_AGE'] if immutable else config['MEDIA_LEGACY_MAX_AGE']
+
+    mode = config['MEDIA_SENDFILE']
+    if mode == 'x-accel-redirect':
+        return _accel_response(path, filename, etag, max_age, immutable)
+
+    response = send_file(
+        path,
+        request.environ,
+        conditional=True,
+        etag=etag if etag else True,
+        max_age=max_age,
+        use_x_sendfile=(mode == 'x-sendfile'),
+        response_class=current_app.response_class
+    )
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""
+Metriche applicative in formato Prometheus
+Labirintoambientale.it
+
+Ogni processo (worker gunicorn o script cron) accumula le metriche in
+memoria e le salva periodicamente in un file JSON dedicato dentro
+METRICS_DIR. L'endpoint /metrics somma i file di tutti i processi, così i
+valori sono aggregati correttamente anche con più worker.
+
+I file dei processi terminati (run del cron, worker riavviati) vengono
+sommati in metrics_archive.json e rimossi a ogni lettura: la directory non
+cresce e i contatori restano monotoni.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: niente compattazione, i file restano
+    fcntl = None
+
+# Bucket di default per latenze (secondi)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Bucket per il ritardo di pubblicazione (secondi): da 30s a 2 giorni
+LAG_BUCKETS = (30, 60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600, 48 * 3600)
+
+# Definizione metriche: nome -> (tipo, descrizione, bucket)
+METRICS = {
+    'http_request_duration_seconds': (
+        'histogram', 'Durata delle richieste HTTP per route', LATENCY_BUCKETS),
+    'db_queries_total': (
+        'counter', 'Numero di query SQL eseguite per route', None),
+    'db_query_duration_seconds_total': (
+        'counter', 'Tempo totale speso in query SQL per route', None),
+    'late_api_request_duration_seconds': (
+        'histogram', 'Durata delle chiamate LATE API per endpoint e status', LATENCY_BUCKETS),
+    'publish_lag_seconds': (
+        'histogram', 'Ritardo tra scheduled_date e published_at', LAG_BUCKETS),
+    'page_cache_requests_total': (
+        'counter', 'Richieste a pagine in cache per route ed esito (hit/miss)', None),
+}
+
+# Intervallo minimo tra due salvataggi su file dello stesso processo
+FLUSH_INTERVAL = 5.0
+
+# Totali dei processi terminati e lock tra compattazione e lettura
+ARCHIVE_FILENAME = 'metrics_archive.json'
+LOCK_FILENAME = '.metrics.lock'
+# File non aggiornati da questo tempo vengono archiviati anche senza verifica del PID
+STALE_SECONDS = 3600
+
+
+def _labels_key(labels):
+    """Chiave ordinata e hashable per un set di label"""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    """Escape valore label secondo il formato testo Prometheus"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    """Formatta label come {k="v",...}"""
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _file_pid(filename):
+    """PID del processo dal nome metrics_<pid>.json (None per altri file)"""
+    if not (filename.startswith('metrics_') and filename.endswith('.json')):
+        return None
+    try:
+        return int(filename[len('metrics_'):-len('.json')])
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    """True se esiste un processo con questo PID"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Es. PermissionError: il processo esiste ma è di un altro utente
+        return True
+    return True
+
+
+def _format_value(value):
+    """Formatta numero senza decimali inutili"""
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """Registro metriche di un singolo processo con persistenza su file"""
+
+    def __init__(self, directory=None):
+        """
+        Args:
+            directory (str): Directory condivisa tra i processi (None = solo memoria)
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._pid = None
+        self._written = None
+        self._last_flush = 0.0
+
+    def configure(self, directory):
+        """Imposta la directory condivisa e registra il salvataggio all'uscita"""
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def _ensure_process(self):
+        """Azzera lo stato se siamo in un nuovo processo (fork di gunicorn)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        self._counters = {}
+        self._histograms = {}
+        self._written = None
+        self._last_flush = 0.0
+        # Un pid riutilizzato riprende i valori del processo precedente,
+        # così i contatori restano monotoni
+        path = self._path()
+        if path and os.path.exists(path):
+            try:
+                self._load_into(path, self._counters, self._histograms)
+                self._written = self._snapshot()
+            except (OSError, ValueError):
+                pass
+
+    def _snapshot(self):
+        """Copia dei valori correnti (quelli appena scritti su file)"""
+        return (dict(self._counters),
+                {key: [list(hist[0]), hist[1], hist[2]] for key, hist in self._histograms.items()})
+
+    def _subtract(self, counters, histograms):
+        """Toglie dai valori del processo quelli già sommati nell'archivio"""
+        for key, value in counters.items():
+            self._counters[key] = self._counters.get(key, 0.0) - value
+        for key, (bucket_counts, total, count) in histograms.items():
+            hist = self._histograms.get(key)
+            if hist is None:
+                continue
+            hist[0] = [c - old for c, old in zip(hist[0], bucket_counts)]
+            hist[1] -= total
+            hist[2] -= count
+
+    def _path(self, pid=None):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f'metrics_{pid or self._pid}.json')
+
+    def inc(self, name, value=1.0, **labels):
+        """Incrementa un contatore"""
+        with self._lock:
+            self._ensure_process()
+            key = (name, _labels_key(labels))
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        """Registra un'osservazione in un istogramma"""
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._ensure_process()
+            key = (name, _labels_key(labels))
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def maybe_flush(self):
+        """Salva su file se è trascorso FLUSH_INTERVAL dall'ultimo salvataggio"""
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """
+        Scrive lo stato del processo corrente su file (scrittura atomica)
+
+        Se il file è sparito dopo l'ultima scrittura, compact() lo ha già
+        sommato nell'archivio: il processo riparte dai soli incrementi
+        successivi, senza contare due volte gli stessi valori.
+        """
+        if not self.directory:
+            return
+        lock = None
+        try:
+            # Lock condiviso: compact() non può archiviare il file a metà scrittura
+            lock = self._lock_file(fcntl.LOCK_SH) if fcntl else None
+            with self._lock:
+                self._ensure_process()
+                path = self._path()
+                if self._written is not None and not os.path.exists(path):
+                    self._subtract(*self._written)
+                data = self._serialize(self._counters, self._histograms)
+                snapshot = self._snapshot()
+                self._last_flush = time.monotonic()
+            self._write(path, data)
+            self._written = snapshot
+        except OSError as e:
+            print(f"⚠️  Impossibile salvare metriche: {e}")
+        finally:
+            if lock is not None:
+                lock.close()
+
+    @staticmethod
+    def _serialize(counters, histograms):
+        return {
+            'counters': [[name, list(labels), value]
+                         for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), hist]
+                           for (name, labels), hist in histograms.items()],
+        }
+
+    @staticmethod
+    def _write(path, data):
+        """Scrittura atomica di un file metriche"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _lock_file(self, mode):
+        """
+        Apre il lock condiviso della directory (None se non disponibile)
+
+        Args:
+            mode: fcntl.LOCK_SH per leggere, fcntl.LOCK_EX per compattare
+        """
+        if fcntl is None:
+            return None
+        lock = open(os.path.join(self.directory, LOCK_FILENAME), 'a')
+        fcntl.flock(lock, mode)
+        return lock
+
+    def compact(self):
+        """
+        Somma in metrics_archive.json i file dei processi terminati e li elimina
+
+        Archiviare per errore il file di un processo ancora vivo non falsa i
+        totali: al salvataggio successivo il processo se ne accorge (vedi flush).
+
+        Returns:
+            int: File di processi terminati rimossi
+        """
+        if not self.directory or fcntl is None:
+            return 0
+        now = time.time()
+        dead = []
+        for name in os.listdir(self.directory):
+            pid = _file_pid(name)
+            if pid is None:
+                continue
+            try:
+                stale = now - os.path.getmtime(os.path.join(self.directory, name)) > STALE_SECONDS
+            except OSError:
+                continue
+            # Il PID si può verificare solo sulla stessa macchina: i file di
+            # processi su altri host (es. cron) vengono archiviati quando invecchiano
+            if stale or not _pid_alive(pid):
+                dead.append(name)
+        if not dead:
+            return 0
+
+        lock = self._lock_file(fcntl.LOCK_EX)
+        try:
+            counters, histograms = {}, {}
+            archive_path = os.path.join(self.directory, ARCHIVE_FILENAME)
+            if os.path.exists(archive_path):
+                self._load_into(archive_path, counters, histograms)
+            merged = []
+            for name in dead:
+                path = os.path.join(self.directory, name)
+                try:
+                    self._load_into(path, counters, histograms)
+                except (OSError, ValueError):
+                    # Già rimosso da un'altra compattazione o corrotto
+                    continue
+                merged.append(path)
+            if not merged:
+                return 0
+            self._write(archive_path, self._serialize(counters, histograms))
+            for path in merged:
+                os.remove(path)
+            return len(merged)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Impossibile compattare metriche: {e}")
+            return 0
+        finally:
+            lock.close()
+
+    @staticmethod
+    def _load_into(path, counters, histograms):
+        """Somma il contenuto di un file metriche nei dizionari indicati"""
+        with open(path) as f:
+            data = json.load(f)
+        for name, labels, value in data.get('counters', []):
+            key = (name, tuple(tuple(l) for l in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, (bucket_counts, total, count) in data.get('histograms', []):
+            if name not in METRICS or len(bucket_counts) != len(METRICS[name][2]):
+                continue
+            key = (name, tuple(tuple(l) for l in labels))
+            hist = histograms.get(key)
+            if hist is None:
+                hist = histograms[key] = [[0] * len(bucket_counts), 0.0, 0]
+            for i, c in enumerate(bucket_counts):
+                hist[0][i] += c
+            hist[1] += total
+            hist[2] += count
+
+    def collect(self):
+        """
+        Aggrega le metriche di tutti i processi
+
+        Returns:
+            tuple: (counters, histograms) sommati su tutti i file
+        """
+        if not self.directory:
+            with self._lock:
+                self._ensure_process()
+                return dict(self._counters), {k: [list(v[0]), v[1], v[2]]
+                                              for k, v in self._histograms.items()}
+        self.flush()
+        self.compact()
+        counters, histograms = {}, {}
+        # Lock condiviso: una compattazione in corso non viene letta a metà
+        lock = self._lock_file(fcntl.LOCK_SH) if fcntl else None
+        try:
+            for filename in os.listdir(self.directory):
+                if not (filename.startswith('metrics_') and filename.endswith('.json')):
+                    continue
+                try:
+                    self._load_into(os.path.join(self.directory, filename), counters, histograms)
+                except (OSError, ValueError):
+                    # File in scrittura o corrotto: lo saltiamo in questo scrape
+                    continue
+        finally:
+            if lock is not None:
+                lock.close()
+        return counters, histograms
+
+    def render(self, gauges=None):
+        """
+        Genera l'output in formato testo Prometheus
+
+        Args:
+            gauges (list): Lista di (nome, descrizione, valore) calcolati al momento
+
+        Returns:
+            str: Testo esposizione Prometheus
+        """
+        counters, histograms = self.collect()
+        lines = []
+
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            else:
+                for (metric, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    # I bucket sono già cumulativi (value <= bound)
+                    for bound, c in zip(buckets, bucket_counts):
+                        le = _format_labels(labels, ('le', _format_value(bound)))
+                        lines.append(f'{name}_bucket{le} {c}')
+                    lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {count}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        for name, help_text, value in gauges or []:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Registro globale del processo
+registry = MetricsRegistry()
+
+
+def inc(name, value=1.0, **labels):
+    """Scorciatoia per registry.inc"""
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Scorciatoia per registry.observe"""
+    registry.observe(name, value, **labels)
+
+
+def _current_route():
+    """Route della richiesta in corso ('background' fuori da una richiesta)"""
+    from flask import has_request_context, request
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+
+def instrument_sqlalchemy():
+    """Registra gli hook SQLAlchemy per contare query e tempo DB per route"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(instrument_sqlalchemy, '_installed', False):
+        return
+    instrument_sqlalchemy._installed = True
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        route = _current_route()
+        inc('db_queries_total', route=route)
+        inc('db_query_duration_seconds_total', elapsed, route=route)
+
+
+def init_app(app):
+    """
+    Attiva la raccolta metriche su un'app Flask
+
+    Args:
+        app (Flask): Applicazione con METRICS_DIR in configurazione
+    """
+    from flask import g, request
+
+    registry.configure(app.config.get('METRICS_DIR'))
+    instrument_sqlalchemy()
+
+    @app.before_request
+    def _metrics_start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            observe('http_request_duration_seconds', time.perf_counter() - start,
+                    route=request.endpoint or 'unmatched',
+                    method=request.method,
+                    status=response.status_code)
+            registry.maybe_flush()
+        return response
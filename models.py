@@ -51,6 +51,11 @@ class Post(db.Model):
     # Note personali (non pubblicate)
     notes = db.Column(db.Text)
     
+    __table_args__ = (
+        # Post programmati in una finestra (cron, calendario, assegnazione orari)
+        db.Index('ix_posts_status_scheduled_date', 'status', 'scheduled_date'),
+    )
+    
     def __repr__(self):
         return f'<Post {self.id}: {self.status} - {self.scheduled_date}>'
     
@@ -172,4 +177,230 @@ class PostTemplate(db.Model):
         """Ritorna lista piattaforme suggerite"""
         if not self.suggested_platforms:
             return []
-        return [p.strip() for p in self.suggested_platforms.split(',') if p.strip()]
\ No newline at end of file
+        return [p.strip() for p in self.suggested_platforms.split(',') if p.strip()]
+
+
+class PublishJob(db.Model):
+    """Job di pubblicazione eseguito in background (es. 'Pubblica Ora')"""
+    __tablename__ = 'publish_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False, index=True)
+    
+    # Stato job
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    # Possibili valori: 'queued', 'running', 'done', 'failed'
+    error_message = db.Column(db.Text)
+    
+    # Timestamp
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<PublishJob {self.id}: post {self.post_id} - {self.status}>'
+    
+    def to_dict(self):
+        """Converte il job in dizionario per JSON"""
+        return {
+            'id': self.id,
+            'post_id': self.post_id,
+            'status': self.status,
+            'error': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class Delivery(db.Model):
+    """Consegna di un post su una singola piattaforma (outbox persistente)"""
+    __tablename__ = 'deliveries'
+    __table_args__ = (
+        db.UniqueConstraint('post_id', 'platform', name='uq_delivery_post_platform'),
+        db.Index('ix_deliveries_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    platform = db.Column(db.String(50), nullable=False)
+    
+    # Stato consegna
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    # Possibili valori: 'pending', 'sending', 'sent', 'failed' (tentativi esauriti)
+    
+    # Retry con backoff esponenziale
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)  # Inizio invio in corso (lease)
+    last_error = db.Column(db.Text)
+    
+    # Risultato
+    late_post_id = db.Column(db.String(100))
+    sent_at = db.Column(db.DateTime)  # Invio a LATE riuscito
+    published_at = db.Column(db.DateTime)  # Pubblicazione effettiva sul social
+    
+    # Modalità hand-off: la pubblicazione è programmata sullo scheduler LATE
+    handoff = db.Column(db.Boolean, nullable=False, default=False)
+    remote_status = db.Column(db.String(20))  # 'scheduled', 'published', 'failed'
+    
+    # Metadata
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relazione con Post (le consegne seguono la cancellazione del post)
+    post = db.relationship('Post', backref=db.backref('deliveries', lazy=True,
+                                                      cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<Delivery {self.id}: post {self.post_id} {self.platform} - {self.status}>'
+
+
+class WebhookEvent(db.Model):
+    """Callback di stato ricevuta da LATE, in coda per l'elaborazione a lotti"""
+    __tablename__ = 'webhook_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(100), unique=True)  # ID evento LATE (deduplica)
+    event_type = db.Column(db.String(50))  # es: 'post.published'
+    payload = db.Column(db.Text, nullable=False)  # JSON originale
+    
+    # Elaborazione
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    # Possibili valori: 'queued', 'processing', 'processed', 'ignored'
+    batch_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    
+    # Timestamp
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<WebhookEvent {self.id}: {self.event_type} - {self.status}>'
+
+
+class PostSeries(db.Model):
+    """Serie ricorrente: regola espansa in post concreti su una finestra mobile"""
+    __tablename__ = 'post_series'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    
+    # Contenuto copiato in ogni occorrenza
+    content = db.Column(db.Text, nullable=False)
+    platforms = db.Column(db.String(200), nullable=False)
+    image_url = db.Column(db.String(500))
+    video_url = db.Column(db.String(500))
+    pinterest_board_id = db.Column(db.String(100))
+    pinterest_link = db.Column(db.String(500))
+    template_name = db.Column(db.String(100))
+    notes = db.Column(db.Text)
+    
+    # Regola di ricorrenza (date e ora in Europe/Rome)
+    frequency = db.Column(db.String(20), nullable=False)  # 'daily', 'weekly', 'monthly'
+    interval = db.Column(db.Integer, nullable=False, default=1)  # ogni N giorni/settimane/mesi
+    weekdays = db.Column(db.String(100))  # Solo weekly, es: "monday,thursday"
+    time_of_day = db.Column(db.String(5), nullable=False)  # "HH:MM"
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date)  # Inclusa (opzionale)
+    max_occurrences = db.Column(db.Integer)  # Opzionale
+    
+    # Stato dell'espansione
+    occurrences_created = db.Column(db.Integer, nullable=False, default=0)
+    expanded_until = db.Column(db.DateTime)  # UTC: occorrenze già create fino a qui
+    is_active = db.Column(db.Boolean, nullable=False, default=True, index=True)
+    
+    # Metadata
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<PostSeries {self.id}: {self.name} ({self.frequency})>'
+    
+    def to_dict(self):
+        """Converte serie in dizionario"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'content': self.content,
+            'platforms': [p.strip() for p in self.platforms.split(',') if p.strip()],
+            'template_name': self.template_name,
+            'frequency': self.frequency,
+            'interval': self.interval,
+            'weekdays': [d for d in (self.weekdays or '').split(',') if d],
+            'time_of_day': self.time_of_day,
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'max_occurrences': self.max_occurrences,
+            'occurrences_created': self.occurrences_created,
+            'expanded_until': self.expanded_until.isoformat() if self.expanded_until else None,
+            'is_active': self.is_active
+        }
+
+
+class SeriesPost(db.Model):
+    """Collegamento tra un post e la serie che lo ha generato"""
+    __tablename__ = 'series_posts'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    series_id = db.Column(db.Integer, db.ForeignKey('post_series.id'), nullable=False, index=True)
+    occurs_at = db.Column(db.DateTime, nullable=False)  # UTC, come scheduled_date originale
+    
+    post = db.relationship('Post', backref=db.backref('series_link', uselist=False,
+                                                      cascade='all, delete-orphan'))
+    series = db.relationship('PostSeries', backref=db.backref('occurrences', lazy='dynamic'))
+    
+    def __repr__(self):
+        return f'<SeriesPost post {self.post_id} serie {self.series_id}>'
+
+
+class PostHashtag(db.Model):
+    """Hashtag usato in un post (indice per statistiche e suggerimenti)"""
+    __tablename__ = 'post_hashtags'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), index=True)  # NULL se archiviato
+    tag = db.Column(db.String(100), nullable=False)  # Minuscolo senza '#', es: "gestionerifiuti"
+    label = db.Column(db.String(100), nullable=False)  # Come scritto nel post, es: "#CER"
+    used_at = db.Column(db.DateTime)  # scheduled_date del post
+    
+    __table_args__ = (
+        db.UniqueConstraint('post_id', 'tag', name='uq_post_hashtag'),
+        # Ricerca per prefisso (intervallo sul tag) e conteggi per tag
+        db.Index('ix_post_hashtags_tag_used_at', 'tag', 'used_at'),
+    )
+    
+    post = db.relationship('Post', backref=db.backref('hashtag_rows', lazy=True,
+                                                      cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<PostHashtag {self.label} post {self.post_id}>'
+
+
+class ContentSignature(db.Model):
+    """Firma MinHash del contenuto di un post (rilevamento quasi-duplicati)"""
+    __tablename__ = 'content_signatures'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
+    signature = db.Column(db.LargeBinary, nullable=False)  # NUM_PERM valori uint32
+    scheduled_date = db.Column(db.DateTime, nullable=False, index=True)
+    
+    post = db.relationship('Post', backref=db.backref('content_signature', uselist=False,
+                                                      cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<ContentSignature post {self.post_id}>'
+
+
+class ContentBucket(db.Model):
+    """Bucket LSH di una banda della firma: post con bucket uguale sono candidati simili"""
+    __tablename__ = 'content_buckets'
+    
+    band = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.BigInteger, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True, index=True)
+    
+    post = db.relationship('Post', backref=db.backref('content_buckets', lazy=True,
+                                                      cascade='all, delete-orphan'))
+    
+    def __repr__(self):
+        return f'<ContentBucket banda {self.band} post {self.post_id}>'
@@ -0,0 +1,677 @@
+# -*- coding: utf-8 -*-
+"""
+Outbox persistente delle consegne per piattaforma
+Labirintoambientale.it
+
+Ogni post da pubblicare genera una riga Delivery per piattaforma. Il
+dispatcher invia le consegne scadute a lotti; un errore su una piattaforma
+riprogramma solo quella consegna con backoff esponenziale, finché non
+riesce o esaurisce i tentativi.
+
+In modalità hand-off (LATE_HANDOFF) le consegne vengono create subito alla
+creazione del post e inviate a LATE con scheduledFor: la pubblicazione
+avviene sullo scheduler LATE e reconcile() ne riporta l'esito nel database.
+"""
+import random
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import or_, select
+
+from models import db, Post, PublicationLog, Delivery
+from config import Config
+import accounts
+import metrics
+
+# Base URL pubblica per i media caricati localmente
+MEDIA_BASE_URL = 'http://labirintoambientale.pythonanywhere.com'
+
+
+def backoff_delay(attempts):
+    """
+    Calcola l'attesa prima del prossimo tentativo
+
+    Args:
+        attempts (int): Tentativi già effettuati (>= 1)
+
+    Returns:
+        timedelta: base * 2^(tentativi-1), limitato a OUTBOX_BACKOFF_MAX, con jitter 10%
+    """
+    seconds = min(Config.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), Config.OUTBOX_BACKOFF_MAX)
+    return timedelta(seconds=seconds * random.uniform(1.0, 1.1))
+
+
+def is_transient(result):
+    """Errori di rete, 429 e 5xx si ritentano; gli altri 4xx no"""
+    status_code = result.get('status_code')
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def enqueue_post(post, handoff=False):
+    """
+    Crea le consegne mancanti per le piattaforme del post (senza commit)
+
+    Args:
+        post (Post): Post da accodare
+        handoff (bool): Consegne da programmare sullo scheduler LATE
+
+    Returns:
+        int: Numero di consegne create
+    """
+    existing = {d.platform for d in Delivery.query.filter_by(post_id=post.id)}
+    next_attempt_at = datetime.utcnow()
+    if not handoff and post.scheduled_date > next_attempt_at:
+        # Piattaforma aggiunta a un post futuro: parte alla sua data
+        next_attempt_at = post.scheduled_date
+    created = 0
+    for platform in post.get_platforms_list():
+        if platform in existing:
+            continue
+        db.session.add(Delivery(
+            post_id=post.id,
+            platform=platform,
+            status='pending',
+            max_attempts=Config.OUTBOX_MAX_ATTEMPTS,
+            next_attempt_at=next_attempt_at,
+            handoff=handoff
+        ))
+        created += 1
+    return created
+
+
+def enqueue_due_posts(now=None, handoff=False):
+    """
+    Crea le consegne per i post programmati già scaduti che non ne hanno
+
+    Args:
+        now (datetime): Istante di riferimento UTC
+        handoff (bool): Accoda anche i post futuri, da programmare su LATE
+
+    Returns:
+        int: Numero di post accodati
+    """
+    now = now or datetime.utcnow()
+    has_deliveries = db.session.query(Delivery.id).filter(Delivery.post_id == Post.id).exists()
+    query = Post.query.filter(Post.status == 'scheduled', ~has_deliveries)
+    if not handoff:
+        query = query.filter(Post.scheduled_date <= now)
+    posts = query.all()
+    for post in posts:
+        enqueue_post(post, handoff=handoff)
+    db.session.commit()
+    return len(posts)
+
+
+def reset_failed(post_ids, at_scheduled_date=False):
+    """
+    Rimette in coda le consegne esaurite dei post indicati (senza commit)
+
+    Args:
+        post_ids (list): ID dei post
+        at_scheduled_date (bool): Nuovo invio alla scheduled_date del post
+            (post riprogrammati) invece che subito
+
+    Returns:
+        int: Consegne rimesse in coda
+    """
+    if not post_ids:
+        return 0
+    next_attempt_at = datetime.utcnow()
+    if at_scheduled_date:
+        # Le nuove date dei post devono essere già nel database
+        db.session.flush()
+        next_attempt_at = select(Post.scheduled_date).where(Post.id == Delivery.post_id).scalar_subquery()
+    return Delivery.query.filter(
+        Delivery.post_id.in_(post_ids),
+        or_(Delivery.status == 'failed', Delivery.remote_status == 'failed')
+    ).update({
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': next_attempt_at,
+        'last_error': None,
+        'remote_status': None,
+        'late_post_id': None
+    }, synchronize_session=False)
+
+
+def reschedule_pending(post_ids):
+    """
+    Sposta alla scheduled_date del post le consegne in attesa (senza commit)
+
+    Serve dopo una modifica della data: una consegna in attesa di retry
+    conserverebbe il vecchio next_attempt_at e drain la invierebbe prima
+    della nuova data. I tentativi ripartono da zero. Le consegne hand-off
+    non cambiano: le riprogramma handoff_post().
+
+    Args:
+        post_ids (list): ID dei post riprogrammati
+
+    Returns:
+        int: Consegne spostate
+    """
+    if not post_ids:
+        return 0
+    # Le nuove date dei post devono essere già nel database
+    db.session.flush()
+    return Delivery.query.filter(
+        Delivery.post_id.in_(post_ids),
+        Delivery.status == 'pending',
+        Delivery.handoff.is_(False)
+    ).update({
+        'attempts': 0,
+        'next_attempt_at': select(Post.scheduled_date).where(Post.id == Delivery.post_id).scalar_subquery(),
+        'last_error': None
+    }, synchronize_session=False)
+
+
+def update_edited_post(post, date_changed):
+    """
+    Allinea le consegne di un post programmato dopo una modifica (senza commit)
+
+    Solo per i post già in outbox (gli altri li accoda enqueue_due_posts alla
+    scadenza): le consegne in attesa di piattaforme rimosse vengono
+    eliminate, le piattaforme aggiunte accodate alla data del post e, se la
+    data è cambiata, le consegne in attesa spostate alla nuova data.
+
+    Args:
+        post (Post): Post modificato
+        date_changed (bool): La scheduled_date è cambiata
+
+    Returns:
+        int: Consegne create per piattaforme aggiunte
+    """
+    deliveries = Delivery.query.filter_by(post_id=post.id).all()
+    if not deliveries:
+        return 0
+    platforms = set(post.get_platforms_list())
+    for delivery in deliveries:
+        if delivery.platform not in platforms and delivery.status == 'pending' and not delivery.handoff:
+            db.session.delete(delivery)
+    created = enqueue_post(post)
+    if date_changed:
+        reschedule_pending([post.id])
+    return created
+
+
+def _claim(delivery_id, now, force=False):
+    """
+    Passa atomicamente una consegna a 'sending'
+
+    Una consegna rimasta in 'sending' oltre OUTBOX_LEASE_SECONDS (processo
+    interrotto) può essere ripresa. `now` serve solo a decidere se la
+    consegna è scaduta; lease e locked_at usano l'orologio al momento del
+    claim, così un drain lungo non assegna lease già scaduti.
+    """
+    claimed_at = datetime.utcnow()
+    lease_expired = claimed_at - timedelta(seconds=Config.OUTBOX_LEASE_SECONDS)
+    query = Delivery.query.filter(
+        Delivery.id == delivery_id,
+        or_(Delivery.status == 'pending',
+            (Delivery.status == 'sending') & (Delivery.locked_at < lease_expired))
+    )
+    if not force:
+        query = query.filter(Delivery.next_attempt_at <= now)
+    claimed = query.update({'status': 'sending', 'locked_at': claimed_at}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+
+def remote_post_id(data):
+    """Estrae l'ID del post dalla risposta LATE ('id', '_id' o annidato in 'post')"""
+    if not isinstance(data, dict):
+        return None
+    data = data.get('post', data)
+    return data.get('id') or data.get('_id')
+
+
+def _parse_remote_datetime(value):
+    """Converte un timestamp ISO 8601 di LATE in datetime UTC naive"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.UTC).replace(tzinfo=None)
+    return parsed
+
+
+def _media_urls(post):
+    media_urls = []
+    if post.image_url:
+        # Se è URL relativo, costruisci URL completo
+        if post.image_url.startswith('/'):
+            media_urls.append(MEDIA_BASE_URL + post.image_url)
+        else:
+            media_urls.append(post.image_url)
+    if post.video_url:
+        if post.video_url.startswith('/'):
+            media_urls.append(MEDIA_BASE_URL + post.video_url)
+        else:
+            media_urls.append(post.video_url)
+    return media_urls
+
+
+def send_delivery(delivery, late_api):
+    """
+    Invia una singola consegna a LATE e registra l'esito (con commit)
+
+    Returns:
+        bool: True se la consegna è andata a buon fine
+    """
+    post = delivery.post
+    platform = delivery.platform
+    account = accounts.get_account(platform)
+
+    # In hand-off i post futuri vengono programmati su LATE
+    scheduled_time = None
+    if delivery.handoff and post.scheduled_date > datetime.utcnow():
+        scheduled_time = pytz.UTC.localize(post.scheduled_date)
+
+    if account is None:
+        result = {'success': False, 'error': f'Account {platform} non configurato o disattivato',
+                  'status_code': 400}
+    else:
+        pinterest_config = None
+        if platform == 'pinterest':
+            pinterest_config = {
+                'board_id': post.pinterest_board_id or account['pinterest_default_board'],
+                'link': post.pinterest_link or 'https://labirintoambientale.it'
+            }
+        media_urls = _media_urls(post)
+        result = late_api.create_post(
+            content=post.content,
+            platforms=[platform],
+            account_ids={platform: account['account_id']},
+            media_urls=media_urls if media_urls else None,
+            scheduled_time=scheduled_time,  # None = pubblica immediatamente
+            pinterest_config=pinterest_config
+        )
+
+    now = datetime.utcnow()
+    delivery.attempts += 1
+    delivery.locked_at = None
+
+    if result['success']:
+        delivery.status = 'sent'
+        delivery.sent_at = now
+        delivery.late_post_id = remote_post_id(result['data'])
+        delivery.last_error = None
+        if scheduled_time:
+            # Hand-off: l'esito arriverà con reconcile()
+            delivery.remote_status = 'scheduled'
+            print(f"📆 Post {post.id} programmato su LATE per {platform}")
+        else:
+            delivery.remote_status = 'published'
+            delivery.published_at = now
+            db.session.add(PublicationLog(
+                post_id=post.id,
+                platform=platform,
+                status='success',
+                late_response=str(result['data'])
+            ))
+            print(f"✅ Post {post.id} pubblicato su {platform}")
+    else:
+        error = str(result.get('error'))
+        delivery.last_error = error
+        if is_transient(result) and delivery.attempts < delivery.max_attempts:
+            delivery.status = 'pending'
+            delivery.next_attempt_at = now + backoff_delay(delivery.attempts)
+            print(f"🔁 Post {post.id} su {platform}: tentativo {delivery.attempts}/"
+                  f"{delivery.max_attempts} fallito, nuovo tentativo alle {delivery.next_attempt_at:%H:%M:%S}")
+        else:
+            delivery.status = 'failed'
+            print(f"❌ Post {post.id} su {platform}: consegna fallita definitivamente: {error}")
+        db.session.add(PublicationLog(
+            post_id=post.id,
+            platform=platform,
+            status='failed',
+            error_message=error
+        ))
+
+    update_post_status(post)
+    db.session.commit()
+    return result['success']
+
+
+def _safe_send(delivery, late_api):
+    """send_delivery che non interrompe il lotto in caso di eccezione"""
+    delivery_id = delivery.id
+    try:
+        db.session.refresh(delivery)
+        return send_delivery(delivery, late_api)
+    except Exception as e:
+        db.session.rollback()
+        delivery = db.session.get(Delivery, delivery_id)
+        delivery.attempts += 1
+        delivery.status = 'pending' if delivery.attempts < delivery.max_attempts else 'failed'
+        delivery.next_attempt_at = datetime.utcnow() + backoff_delay(delivery.attempts)
+        delivery.locked_at = None
+        delivery.last_error = str(e)
+        update_post_status(delivery.post)
+        db.session.commit()
+        print(f"❌ Eccezione durante consegna {delivery_id}: {e}")
+        return False
+
+
+def _delivery_state(delivery):
+    """Stato effettivo di una consegna: 'pending', 'sent' o 'failed'"""
+    if delivery.status in ('pending', 'sending'):
+        return 'pending'
+    if delivery.status == 'failed' or delivery.remote_status == 'failed':
+        return 'failed'
+    if delivery.handoff and delivery.remote_status != 'published':
+        # Programmata su LATE, in attesa di riconciliazione
+        return 'pending'
+    return 'sent'
+
+
+def update_post_status(post):
+    """
+    Deriva lo stato del post dalle sue consegne
+
+    Il post resta 'scheduled' finché c'è una consegna in corso, in attesa di
+    retry o programmata su LATE; poi diventa 'published' se tutte sono
+    andate a buon fine, altrimenti 'failed' con l'elenco delle piattaforme
+    fallite.
+    """
+    deliveries = Delivery.query.filter_by(post_id=post.id).all()
+    states = {d.id: _delivery_state(d) for d in deliveries}
+    if not deliveries or 'pending' in states.values():
+        failing = [f'{d.platform}: {d.last_error}' for d in deliveries if d.last_error]
+        post.error_message = '; '.join(failing) or None
+        return
+
+    sent = [d for d in deliveries if states[d.id] == 'sent']
+    failed = [d for d in deliveries if states[d.id] == 'failed']
+    if sent and not post.late_post_id:
+        post.late_post_id = sent[0].late_post_id
+    if sent and not post.published_at:
+        post.published_at = max(d.published_at or d.sent_at for d in sent)
+
+    if failed:
+        post.status = 'failed'
+        post.error_message = '; '.join(f'{d.platform}: {d.last_error}' for d in failed)
+    elif post.status != 'published':
+        post.status = 'published'
+        post.error_message = None
+        metrics.observe('publish_lag_seconds',
+                        (post.published_at - post.scheduled_date).total_seconds())
+
+
+def _cancel_remote(delivery, late_api):
+    """Elimina da LATE una consegna programmata in hand-off e la rimette in coda"""
+    if delivery.late_post_id:
+        result = late_api.delete_scheduled_post(delivery.late_post_id)
+        if not result['success']:
+            print(f"⚠️  Eliminazione LATE {delivery.late_post_id} fallita: {result.get('error')}")
+    delivery.status = 'pending'
+    delivery.remote_status = None
+    delivery.late_post_id = None
+    delivery.sent_at = None
+    delivery.attempts = 0
+    delivery.last_error = None
+    delivery.next_attempt_at = datetime.utcnow()
+
+
+def handoff_post(post, late_api):
+    """
+    Programma (o riprogramma dopo una modifica) il post sullo scheduler LATE
+
+    Le consegne già programmate vengono eliminate da LATE e reinviate con
+    contenuto e data aggiornati; quelle di piattaforme rimosse vengono
+    cancellate.
+    """
+    platforms = set(post.get_platforms_list())
+    for delivery in Delivery.query.filter_by(post_id=post.id).all():
+        if delivery.status == 'sent' and delivery.remote_status == 'scheduled':
+            _cancel_remote(delivery, late_api)
+        if delivery.platform not in platforms:
+            db.session.delete(delivery)
+        else:
+            delivery.handoff = True
+    enqueue_post(post, handoff=True)
+    db.session.commit()
+
+    now = datetime.utcnow()
+    for delivery in Delivery.query.filter_by(post_id=post.id, status='pending').all():
+        if _claim(delivery.id, now, force=True):
+            _safe_send(delivery, late_api)
+
+    update_post_status(post)
+    db.session.commit()
+
+
+def deliver_post(post, late_api):
+    """
+    Invia subito tutte le consegne non concluse di un post (ignora il backoff)
+
+    Returns:
+        bool: True se il post risulta pubblicato su tutte le piattaforme
+    """
+    # Le consegne programmate su LATE vengono anticipate a ora
+    for delivery in Delivery.query.filter_by(post_id=post.id, status='sent',
+                                             remote_status='scheduled').all():
+        _cancel_remote(delivery, late_api)
+        delivery.handoff = False
+    enqueue_post(post)
+    db.session.commit()
+
+    now = datetime.utcnow()
+    for delivery in Delivery.query.filter(
+        Delivery.post_id == post.id,
+        Delivery.status.in_(('pending', 'sending'))
+    ).all():
+        if _claim(delivery.id, now, force=True):
+            _safe_send(delivery, late_api)
+
+    update_post_status(post)
+    db.session.commit()
+    return post.status == 'published'
+
+
+def drain(late_api, batch_size=None, now=None):
+    """
+    Invia le consegne scadute a lotti finché non ne restano
+
+    Args:
+        late_api (LateAPI): Client LATE
+        batch_size (int): Consegne per lotto (default OUTBOX_BATCH_SIZE)
+
+    Returns:
+        tuple: (inviate con successo, fallite o riprogrammate)
+    """
+    batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+    now = now or datetime.utcnow()
+    sent = failed = 0
+
+    # Ogni consegna elaborata esce dalla selezione (inviata, fallita o
+    # riprogrammata dopo `now`), quindi il ciclo termina
+    while True:
+        # Lease valutati sull'orologio corrente, come in _claim()
+        lease_expired = datetime.utcnow() - timedelta(seconds=Config.OUTBOX_LEASE_SECONDS)
+        batch = Delivery.query.filter(
+            or_((Delivery.status == 'pending') & (Delivery.next_attempt_at <= now),
+                (Delivery.status == 'sending') & (Delivery.locked_at < lease_expired))
+        ).order_by(Delivery.next_attempt_at.asc()).limit(batch_size).all()
+        if not batch:
+            break
+
+        for delivery in batch:
+            if not _claim(delivery.id, now):
+                continue
+            if _safe_send(delivery, late_api):
+                sent += 1
+            else:
+                failed += 1
+
+    return sent, failed
+
+
+def _remote_platform_state(delivery, remote):
+    """
+    Stato finale della piattaforma della consegna nel post LATE
+
+    Returns:
+        tuple: (stato 'published'/'failed' oppure None se non finale, voce piattaforma)
+    """
+    status = remote.get('status')
+    if status not in ('published', 'failed', 'partial'):
+        return None, {}
+
+    # Con una piattaforma per consegna lo stato del post coincide con quello
+    # della piattaforma; per 'partial' leggiamo la voce specifica
+    platform_info = next((p for p in remote.get('platforms', [])
+                          if p.get('platform') == delivery.platform), {})
+    if status == 'partial':
+        status = platform_info.get('status', 'failed')
+    return ('published' if status == 'published' else 'failed'), platform_info
+
+
+def _remote_published_at(remote, platform_info):
+    return (_parse_remote_datetime(platform_info.get('publishedAt'))
+            or _parse_remote_datetime(remote.get('publishedAt'))
+            or datetime.utcnow())
+
+
+def _mark_remote_failed(delivery, remote, platform_info):
+    """Consegna fallita su LATE, con voce di log"""
+    delivery.remote_status = 'failed'
+    delivery.last_error = str(platform_info.get('errorMessage') or remote.get('error')
+                              or 'Pubblicazione fallita su LATE')
+    db.session.add(PublicationLog(
+        post_id=delivery.post_id,
+        platform=delivery.platform,
+        status='failed',
+        error_message=delivery.last_error
+    ))
+
+
+def apply_remote_state(delivery, remote):
+    """
+    Aggiorna una consegna hand-off con lo stato letto da LATE
+
+    Returns:
+        bool: True se la consegna ha raggiunto uno stato finale
+    """
+    remote = remote.get('post', remote)
+    status, platform_info = _remote_platform_state(delivery, remote)
+    if status is None:
+        return False
+
+    if status == 'published':
+        delivery.remote_status = 'published'
+        delivery.published_at = _remote_published_at(remote, platform_info)
+        db.session.add(PublicationLog(
+            post_id=delivery.post_id,
+            platform=delivery.platform,
+            status='success',
+            late_response=str(remote),
+            published_url=platform_info.get('platformPostUrl')
+        ))
+    else:
+        _mark_remote_failed(delivery, remote, platform_info)
+    return True
+
+
+def apply_callback(delivery, remote):
+    """
+    Applica una callback LATE a una consegna già inviata
+
+    Le consegne hand-off in attesa ('scheduled') ricevono l'esito come in
+    reconcile(). Per gli invii immediati LATE ha solo accettato il post
+    (remote_status 'published' provvisorio): un 'failed' lo segna come
+    fallito, un 'published' completa data e URL nel log già presente.
+    Consegne già concluse dalla callback non cambiano più.
+
+    Returns:
+        bool: True se la consegna è stata aggiornata
+    """
+    if delivery.status != 'sent':
+        return False
+    if delivery.remote_status == 'scheduled':
+        return apply_remote_state(delivery, remote)
+    if delivery.handoff or delivery.remote_status != 'published':
+        return False
+
+    remote = remote.get('post', remote)
+    status, platform_info = _remote_platform_state(delivery, remote)
+    if status is None:
+        return False
+    if status == 'failed':
+        _mark_remote_failed(delivery, remote, platform_info)
+        return True
+
+    log = PublicationLog.query.filter_by(post_id=delivery.post_id, platform=delivery.platform,
+                                         status='success') \
+        .order_by(PublicationLog.id.desc()).first()
+    published_url = platform_info.get('platformPostUrl')
+    if log is not None and published_url and log.published_url != published_url:
+        log.published_url = published_url
+        delivery.published_at = _remote_published_at(remote, platform_info)
+        return True
+    return False
+
+
+def reconcile(late_api, batch_size=None, now=None, max_pages=20):
+    """
+    Riporta nel database l'esito delle consegne programmate su LATE
+
+    Considera solo le consegne hand-off già scadute. Lo stato remoto viene
+    letto a pagine con list_posts(); gli ID non trovati vengono chiesti
+    singolarmente con get_post().
+
+    Returns:
+        int: Numero di consegne arrivate a uno stato finale
+    """
+    batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+    now = now or datetime.utcnow()
+
+    waiting = Delivery.query.join(Post).filter(
+        Delivery.handoff.is_(True),
+        Delivery.status == 'sent',
+        Delivery.remote_status == 'scheduled',
+        Post.scheduled_date <= now
+    ).all()
+    by_remote_id = {d.late_post_id: d for d in waiting if d.late_post_id}
+    if not by_remote_id:
+        return 0
+
+    remote_states = {}
+    for status in ('published', 'failed'):
+        for page in range(1, max_pages + 1):
+            result = late_api.list_posts(status=status, page=page, limit=batch_size)
+            if not result['success']:
+                print(f"⚠️  Riconciliazione: lista post LATE non disponibile: {result.get('error')}")
+                break
+            for remote in result['posts']:
+                remote_id = remote_post_id(remote)
+                if remote_id in by_remote_id:
+                    remote_states[remote_id] = remote
+            if len(result['posts']) < batch_size or len(remote_states) == len(by_remote_id):
+                break
+
+    for remote_id in set(by_remote_id) - set(remote_states):
+        result = late_api.get_post(remote_id)
+        if result['success']:
+            remote_states[remote_id] = result['data']
+
+    resolved = 0
+    touched_posts = set()
+    for i, (remote_id, remote) in enumerate(remote_states.items(), start=1):
+        delivery = by_remote_id[remote_id]
+        if apply_remote_state(delivery, remote):
+            resolved += 1
+            touched_posts.add(delivery.post)
+        # Commit a lotti per non tenere bloccato il database
+        if i % batch_size == 0:
+            for post in touched_posts:
+                update_post_status(post)
+            db.session.commit()
+            touched_posts.clear()
+
+    for post in touched_posts:
+        update_post_status(post)
+    db.session.commit()
+    return resolved
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Filtri comuni sui post (azioni massive, ricerca, export)
+Labirintoambientale.it
+"""
+from datetime import datetime, timedelta
+
+import pytz
+
+from models import Post
+
+
+class FilterError(ValueError):
+    """Filtro non valido (es. data malformata)"""
+
+
+def rome_to_utc(value, fmt='%Y-%m-%d'):
+    """
+    Converte una stringa data/ora Europe/Rome in datetime UTC naive
+
+    Args:
+        value (str): Data/ora locale
+        fmt (str): Formato strptime
+
+    Returns:
+        datetime: Datetime UTC senza tzinfo, come salvato nel database
+    """
+    rome_tz = pytz.timezone('Europe/Rome')
+    try:
+        local = rome_tz.localize(datetime.strptime(value, fmt))
+    except (TypeError, ValueError):
+        raise FilterError(f'Data non valida: {value}')
+    return local.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def parse_ids(values):
+    """
+    Converte una lista di ID post in interi
+
+    Raises:
+        FilterError: Se values non è una lista o contiene valori non numerici
+    """
+    if not isinstance(values, (list, tuple)):
+        raise FilterError('ids deve essere una lista di ID numerici')
+    ids = []
+    for value in values:
+        # bool è un int per Python, ma true/false non sono ID validi
+        if isinstance(value, bool):
+            raise FilterError(f'ID post non valido: {value}')
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            raise FilterError(f'ID post non valido: {value}')
+    return ids
+
+
+def apply_post_filters(query, filters, date_column=None):
+    """
+    Applica i filtri standard a una query che include Post
+
+    Args:
+        query (Query): Query SQLAlchemy
+        filters (dict): Chiavi supportate: ids, status, platform,
+            date_from, date_to (YYYY-MM-DD, ora di Roma, estremi inclusi)
+        date_column: Colonna per i filtri data (default Post.scheduled_date)
+
+    Returns:
+        Query: Query filtrata
+
+    Raises:
+        FilterError: Filtri non in forma di dizionario, ID o date non validi
+    """
+    if not isinstance(filters, dict):
+        raise FilterError('I filtri devono essere un oggetto {chiave: valore}')
+    for key in ('status', 'platform', 'date_from', 'date_to'):
+        if filters.get(key) and not isinstance(filters[key], str):
+            raise FilterError(f'{key} deve essere una stringa')
+    date_column = date_column if date_column is not None else Post.scheduled_date
+
+    if filters.get('ids'):
+        query = query.filter(Post.id.in_(parse_ids(filters['ids'])))
+    if filters.get('status'):
+        query = query.filter(Post.status == filters['status'])
+    if filters.get('platform'):
+        query = query.filter(Post.platforms.like(f"%{filters['platform']}%"))
+    if filters.get('date_from'):
+        query = query.filter(date_column >= rome_to_utc(filters['date_from']))
+    if filters.get('date_to'):
+        query = query.filter(date_column < rome_to_utc(filters['date_to']) + timedelta(days=1))
+    return query
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Indici derivati dal contenuto dei post
+Labirintoambientale.it
+
+Hashtag (hashtags.py) e firme anti-duplicato (duplicates.py) sono righe
+calcolate dal testo e dalla data di ogni post. Entrambi registrano qui la
+propria funzione di sincronizzazione: un unico hook before_flush la chiama
+per i post nuovi e per quelli con contenuto o data modificati (app, cron,
+serie ricorrenti, azioni massive). reindex() e ensure_index() ricostruiscono
+un indice per tutti i post, a blocchi.
+"""
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, configure_mappers
+
+from models import db, Post
+
+# Attributi del post da cui dipendono gli indici
+WATCHED_ATTRIBUTES = ('content', 'scheduled_date')
+
+_syncs = []
+
+
+def register(sync):
+    """
+    Aggiunge una funzione sync(post) chiamata quando il contenuto di un post cambia
+
+    Installa l'hook di sessione alla prima registrazione; registrare due
+    volte la stessa funzione non ha effetto.
+    """
+    if sync not in _syncs:
+        _syncs.append(sync)
+    _install()
+
+
+def _content_changed(post):
+    state = inspect(post)
+    return any(state.attrs[name].history.has_changes() for name in WATCHED_ATTRIBUTES)
+
+
+def _install():
+    if getattr(_install, '_installed', False):
+        return
+    _install._installed = True
+
+    @event.listens_for(Session, 'before_flush')
+    def _before_flush(session, flush_context, instances):
+        changed = [obj for obj in session.new if isinstance(obj, Post)]
+        changed += [obj for obj in session.dirty
+                    if isinstance(obj, Post) and obj not in session.deleted and _content_changed(obj)]
+        for post in changed:
+            for sync in _syncs:
+                sync(post)
+
+
+def reindex(sync, relationships, batch_size=500):
+    """
+    Ricalcola un indice per tutti i post (commit a blocchi)
+
+    Args:
+        sync (callable): Funzione sync(post) dell'indice
+        relationships (list): Nomi delle relazioni di Post da caricare insieme ai post
+        batch_size (int): Post per blocco
+
+    Returns:
+        int: Post elaborati
+    """
+    # Le relazioni backref esistono su Post solo dopo la configurazione dei mapper
+    configure_mappers()
+    options = [db.selectinload(getattr(Post, name)) for name in relationships]
+    processed = 0
+    last_id = 0
+    while True:
+        posts = Post.query.options(*options) \
+            .filter(Post.id > last_id).order_by(Post.id.asc()).limit(batch_size).all()
+        if not posts:
+            break
+        # Letto prima del commit: dopo expunge_all gli oggetti sono staccati
+        last_id = posts[-1].id
+        for post in posts:
+            sync(post)
+        db.session.commit()
+        db.session.expunge_all()
+        processed += len(posts)
+    return processed
+
+
+def ensure_index(index_column, sync, relationships):
+    """
+    Popola un indice vuoto se esistono post (primo init-db dopo l'aggiornamento)
+
+    Args:
+        index_column: Colonna della tabella dell'indice
+        sync (callable): Funzione sync(post) dell'indice
+        relationships (list): Nomi delle relazioni di Post da caricare
+
+    Returns:
+        int: Post elaborati (0 se l'indice era già popolato)
+    """
+    if db.session.query(index_column).first() is not None or db.session.query(Post.id).first() is None:
+        return 0
+    return reindex(sync, relationships)
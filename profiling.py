@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Profilazione SQL per richiesta e log delle query lente
+Labirintoambientale.it
+
+Attivabile con SQL_PROFILING=1. Per ogni richiesta conta le query, somma il
+tempo DB e tiene le N istruzioni più lente; il riepilogo viene esposto
+nell'header X-DB-Profile e stampato su una riga di log. Le query oltre
+SLOW_QUERY_MS finiscono nel file SLOW_QUERY_LOG insieme al loro
+EXPLAIN QUERY PLAN.
+"""
+import time
+from datetime import datetime
+
+
+def _explain(conn, statement, parameters):
+    """
+    Esegue EXPLAIN QUERY PLAN sulla stessa connessione DBAPI
+
+    Usa il cursore DBAPI grezzo per non rientrare negli eventi SQLAlchemy.
+
+    Returns:
+        list: Righe del piano ('id|parent|detail') o messaggio di errore
+    """
+    if conn.dialect.name != 'sqlite':
+        return []
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return []
+    try:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ())
+            return [' | '.join(str(col) for col in row) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except Exception as e:
+        return [f'EXPLAIN non disponibile: {e}']
+
+
+class SQLProfiler:
+    """Raccoglie statistiche SQL per richiesta tramite eventi SQLAlchemy"""
+
+    def __init__(self, slow_query_ms=100, slow_query_log=None, top_n=3):
+        """
+        Args:
+            slow_query_ms (float): Soglia in millisecondi per il log query lente
+            slow_query_log (str): Percorso file log query lente (None = solo stdout)
+            top_n (int): Numero di query più lente riportate per richiesta
+        """
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.top_n = top_n
+
+    def _current(self):
+        """Statistiche della richiesta corrente (None fuori richiesta)"""
+        from flask import g, has_request_context
+        if not has_request_context():
+            return None
+        return g.get('_sql_profile')
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiling_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profiling_query_start')
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+
+        profile = self._current()
+        if profile is not None:
+            profile['count'] += 1
+            profile['time_ms'] += elapsed_ms
+            profile['statements'].append((elapsed_ms, statement))
+
+        if elapsed_ms >= self.slow_query_ms and not executemany:
+            self.log_slow_query(statement, parameters, elapsed_ms,
+                                _explain(conn, statement, parameters))
+
+    def log_slow_query(self, statement, parameters, elapsed_ms, plan):
+        """Scrive una query lenta (con piano di esecuzione) nel log dedicato"""
+        from flask import has_request_context, request
+        route = request.endpoint if has_request_context() else 'background'
+        lines = [
+            f"[{datetime.utcnow().isoformat()}] {elapsed_ms:.1f}ms route={route}",
+            f"  SQL: {' '.join(statement.split())}",
+            f"  Parametri: {parameters!r}",
+        ]
+        lines.extend(f"  PLAN: {row}" for row in plan)
+        entry = '\n'.join(lines) + '\n'
+
+        if self.slow_query_log:
+            try:
+                with open(self.slow_query_log, 'a', encoding='utf-8') as f:
+                    f.write(entry)
+                return
+            except OSError as e:
+                print(f"⚠️  Impossibile scrivere slow query log: {e}")
+        print(f"🐢 Query lenta\n{entry}", end='')
+
+    def start_request(self):
+        from flask import g
+        g._sql_profile = {'count': 0, 'time_ms': 0.0, 'statements': []}
+
+    def finish_request(self, response):
+        """Aggiunge l'header X-DB-Profile e stampa il riepilogo della richiesta"""
+        from flask import g, request
+        profile = g.pop('_sql_profile', None)
+        if profile is None:
+            return response
+
+        slowest = sorted(profile['statements'], key=lambda s: s[0], reverse=True)[:self.top_n]
+        response.headers['X-DB-Profile'] = (
+            f"queries={profile['count']}; time_ms={profile['time_ms']:.2f}"
+        )
+        summary = ', '.join(
+            f"{ms:.2f}ms {' '.join(sql.split())[:120]}" for ms, sql in slowest
+        )
+        print(f"🔎 {request.method} {request.path} → {profile['count']} query, "
+              f"{profile['time_ms']:.2f}ms DB | più lente: {summary or '-'}")
+        return response
+
+
+profiler = SQLProfiler()
+
+
+def _install_listeners():
+    """Registra una sola volta per processo gli hook globali su Engine"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(_install_listeners, '_installed', False):
+        return
+    _install_listeners._installed = True
+    event.listen(Engine, 'before_cursor_execute', profiler.before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', profiler.after_cursor_execute)
+
+
+def init_app(app):
+    """
+    Attiva la profilazione SQL se SQL_PROFILING è abilitato
+
+    Gli hook su Engine valgono per tutto il processo: una seconda
+    create_app() (test, CLI) aggiorna soglia e log del profiler condiviso
+    invece di registrarli di nuovo e contare ogni query due volte.
+
+    Args:
+        app (Flask): Applicazione Flask configurata
+    """
+    if not app.config.get('SQL_PROFILING'):
+        return None
+
+    profiler.slow_query_ms = app.config.get('SLOW_QUERY_MS', 100)
+    profiler.slow_query_log = app.config.get('SLOW_QUERY_LOG')
+    _install_listeners()
+    app.before_request(profiler.start_request)
+    app.after_request(profiler.finish_request)
+    return profiler
@@ -7,27 +7,24 @@ Labirintoambientale.it Social Media Scheduler
 """
 import os
 import sys
-from datetime import datetime, timedelta
-import pytz
+from datetime import datetime
 
 # Aggiungi directory progetto al path
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, BASE_DIR)
 
-from models import db, Post, PublicationLog
-from late_api import LateAPI
+from models import db, Post
 from config import Config
+from factory import create_db_app, get_late_api
+import metrics
+import outbox
+import webhooks
+import archive
+import recurrence
 
 def setup_app():
-    """Setup Flask app context per accesso database"""
-    from flask import Flask
-    
-    app = Flask(__name__)
-    app.config.from_object(Config)
-    
-    db.init_app(app)
-    
-    return app
+    """Setup Flask app context per accesso database (senza route web)"""
+    return create_db_app(Config)
 
 def get_posts_to_publish():
     """
@@ -48,91 +45,22 @@ def get_posts_to_publish():
 
 def publish_post(post, late_api):
     """
-    Pubblica singolo post tramite LATE API
+    Pubblica subito un post tramite l'outbox delle consegne
+    
+    Le consegne già riuscite non vengono ripetute; quelle fallite per errori
+    transitori restano in coda con backoff e vengono riprese da main().
     
     Args:
         post (Post): Oggetto Post da pubblicare
         late_api (LateAPI): Istanza client LATE API
     
     Returns:
-        bool: True se successo, False altrimenti
+        bool: True se pubblicato su tutte le piattaforme, False altrimenti
     """
     try:
-        # Prepara configurazione piattaforme
-        platforms = post.get_platforms_list()
-        account_ids = Config.SOCIAL_ACCOUNTS
-        
-        # Media URLs
-        media_urls = []
-        if post.image_url:
-            # Se è URL relativo, costruisci URL completo
-            if post.image_url.startswith('/'):
-                # In produzione su PythonAnywhere
-                base_url = 'http://labirintoambientale.pythonanywhere.com'
-                media_urls.append(base_url + post.image_url)
-            else:
-                media_urls.append(post.image_url)
-                
-        if post.video_url:
-            media_urls.append(post.video_url)
-        
-        # Configurazione Pinterest
-        pinterest_config = None
-        if 'pinterest' in platforms:
-            pinterest_config = {
-                'board_id': post.pinterest_board_id or Config.PINTEREST_DEFAULT_BOARD,
-                'link': post.pinterest_link or 'https://labirintoambientale.it'
-            }
-        
-        # Chiama LATE API per pubblicare
-        result = late_api.create_post(
-            content=post.content,
-            platforms=platforms,
-            account_ids=account_ids,
-            media_urls=media_urls if media_urls else None,
-            scheduled_time=None,  # Pubblica immediatamente
-            pinterest_config=pinterest_config
-        )
-        
-        if result['success']:
-            # Aggiorna stato post
-            post.status = 'published'
-            post.published_at = datetime.utcnow()
-            post.late_post_id = result['data'].get('id')
-            
-            # Crea log successo per ogni piattaforma
-            for platform in platforms:
-                log = PublicationLog(
-                    post_id=post.id,
-                    platform=platform,
-                    status='success',
-                    late_response=str(result['data'])
-                )
-                db.session.add(log)
-            
-            print(f"✅ Post {post.id} pubblicato con successo su {', '.join(platforms)}")
-            return True
-            
-        else:
-            # Errore pubblicazione
-            post.status = 'failed'
-            post.error_message = str(result.get('error'))
-            
-            # Crea log errore
-            for platform in platforms:
-                log = PublicationLog(
-                    post_id=post.id,
-                    platform=platform,
-                    status='failed',
-                    error_message=post.error_message
-                )
-                db.session.add(log)
-            
-            print(f"❌ Errore pubblicazione post {post.id}: {post.error_message}")
-            return False
-            
+        return outbox.deliver_post(post, late_api)
     except Exception as e:
-        post.status = 'failed'
+        db.session.rollback()
         post.error_message = str(e)
         print(f"❌ Eccezione durante pubblicazione post {post.id}: {str(e)}")
         return False
@@ -146,6 +74,8 @@ def main():
     
     # Setup Flask app e database
     app = setup_app()
+    metrics.registry.configure(Config.METRICS_DIR)
+    metrics.instrument_sqlalchemy()
     
     with app.app_context():
         # Verifica configurazione LATE API
@@ -155,39 +85,47 @@ def main():
             return
         
         # Inizializza client LATE
-        late_api = LateAPI(Config.LATE_API_KEY)
+        late_api = get_late_api(app)
+        
+        # Serie ricorrenti: crea i post della finestra mobile
+        series_posts = recurrence.expand_all()
+        if series_posts:
+            print(f"🔁 Post creati dalle serie ricorrenti: {series_posts}")
         
-        # Recupera post da pubblicare
+        # Crea le consegne per i post scaduti (in hand-off anche per quelli
+        # futuri non ancora programmati su LATE)
         posts_to_publish = get_posts_to_publish()
+        enqueued = outbox.enqueue_due_posts(handoff=Config.LATE_HANDOFF)
+        print(f"📋 Post scaduti: {len(posts_to_publish)} ({enqueued} nuovi in outbox)\n")
         
-        if not posts_to_publish:
-            print("ℹ️  Nessun post da pubblicare al momento")
-            return
+        # Invia le consegne scadute (nuove e retry) a lotti
+        success_count, failed_count = outbox.drain(late_api)
+        
+        # Callback LATE rimaste in coda (es. worker riavviato prima del flush)
+        webhook_events = webhooks.process_pending()
+        if webhook_events:
+            print(f"📨 Eventi webhook elaborati: {webhook_events}")
         
-        print(f"📋 Trovati {len(posts_to_publish)} post da pubblicare\n")
+        # Riporta l'esito dei post programmati sullo scheduler LATE (hand-off)
+        reconciled = outbox.reconcile(late_api)
+        if reconciled:
+            print(f"🔄 Consegne hand-off riconciliate: {reconciled}")
         
-        # Pubblica ogni post
-        success_count = 0
-        failed_count = 0
+        # Retention: sposta negli archivi i post conclusi più vecchi
+        if Config.RETENTION_DAYS:
+            archived = archive.archive_old_posts()
+            if archived:
+                archive.incremental_vacuum()
+                print(f"📦 Post archiviati: {archived}")
         
-        for post in posts_to_publish:
-            print(f"📤 Pubblicazione post #{post.id}...")
-            print(f"   Piattaforme: {post.platforms}")
-            print(f"   Schedulato per: {post.scheduled_date}")
-            
-            if publish_post(post, late_api):
-                success_count += 1
-            else:
-                failed_count += 1
-            
-            # Salva modifiche database
-            db.session.commit()
-            print()
+        if not success_count and not failed_count:
+            print("ℹ️  Nessuna consegna da inviare al momento")
+            return
         
         # Riepilogo
         print(f"{'='*60}")
-        print(f"✅ Pubblicati con successo: {success_count}")
-        print(f"❌ Falliti: {failed_count}")
+        print(f"✅ Consegne riuscite: {success_count}")
+        print(f"❌ Consegne fallite o da ritentare: {failed_count}")
         print(f"{'='*60}\n")
 
 if __name__ == '__main__':
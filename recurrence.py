@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Serie di post ricorrenti espanse su una finestra mobile
+Labirintoambientale.it
+
+Una PostSeries salva solo la regola (giornaliera, settimanale, mensile) e il
+contenuto. Lo script cron crea i post concreti per i prossimi
+SERIES_WINDOW_DAYS giorni: database e calendario contengono solo le
+occorrenze vicine, non l'intera serie. Ogni post creato resta un normale
+post programmato, modificabile singolarmente prima della pubblicazione.
+"""
+import calendar
+from datetime import date, datetime, timedelta
+
+import click
+import pytz
+from flask.cli import with_appcontext
+
+from config import Config
+from models import db, Post, PostSeries, SeriesPost
+
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+class SeriesError(ValueError):
+    """Regola di ricorrenza non valida"""
+
+
+def _parse_date(value, field):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise SeriesError(f'{field} non valida: {value}')
+
+
+def create_series(data):
+    """
+    Crea una serie ricorrente (senza commit)
+
+    Args:
+        data (dict): name, content, platforms (lista o stringa), frequency,
+            interval, weekdays (weekly), time_of_day 'HH:MM', start_date
+            'YYYY-MM-DD', end_date, max_occurrences, template_name, notes,
+            image_url, video_url, pinterest_board_id, pinterest_link.
+            Con post_id contenuto e media vengono copiati dal post indicato.
+
+    Returns:
+        PostSeries: Serie aggiunta alla sessione
+    """
+    if not isinstance(data, dict):
+        raise SeriesError('Dati della serie non validi: atteso un oggetto')
+    data = dict(data)
+    if data.get('post_id'):
+        try:
+            source_id = int(data['post_id'])
+        except (TypeError, ValueError):
+            raise SeriesError(f"post_id non valido: {data['post_id']}")
+        source = db.session.get(Post, source_id)
+        if source is None:
+            raise SeriesError(f"Post {data['post_id']} non trovato")
+        for field in ('content', 'platforms', 'image_url', 'video_url', 'pinterest_board_id',
+                      'pinterest_link', 'template_name', 'notes'):
+            data.setdefault(field, getattr(source, field))
+
+    platforms = data.get('platforms') or []
+    if isinstance(platforms, str):
+        platforms = [p.strip() for p in platforms.split(',')]
+    platforms = [p for p in platforms if p]
+    if not data.get('content') or not platforms:
+        raise SeriesError('Contenuto e piattaforme sono obbligatori')
+
+    frequency = data.get('frequency')
+    if frequency not in FREQUENCIES:
+        raise SeriesError(f'Frequenza non supportata: {frequency}')
+    try:
+        interval = int(data.get('interval') or 1)
+        max_occurrences = int(data['max_occurrences']) if data.get('max_occurrences') else None
+        datetime.strptime(data.get('time_of_day') or '', '%H:%M')
+    except (TypeError, ValueError):
+        raise SeriesError('interval, max_occurrences o time_of_day non validi')
+    if interval < 1:
+        raise SeriesError('interval deve essere almeno 1')
+
+    weekdays = data.get('weekdays') or []
+    if isinstance(weekdays, str):
+        weekdays = [d.strip() for d in weekdays.split(',')]
+    weekdays = [d.lower() for d in weekdays if d]
+    if frequency == 'weekly':
+        if not weekdays:
+            raise SeriesError('Indicare almeno un giorno della settimana')
+        unknown = [d for d in weekdays if d not in WEEKDAYS]
+        if unknown:
+            raise SeriesError(f'Giorni non validi: {unknown}')
+
+    start_date = _parse_date(data.get('start_date'), 'start_date')
+    end_date = _parse_date(data['end_date'], 'end_date') if data.get('end_date') else None
+    if end_date and end_date < start_date:
+        raise SeriesError('end_date precedente a start_date')
+
+    series = PostSeries(
+        name=data.get('name') or data.get('template_name') or 'Serie',
+        content=data['content'],
+        platforms=','.join(platforms),
+        image_url=data.get('image_url'),
+        video_url=data.get('video_url'),
+        pinterest_board_id=data.get('pinterest_board_id'),
+        pinterest_link=data.get('pinterest_link'),
+        template_name=data.get('template_name'),
+        notes=data.get('notes'),
+        frequency=frequency,
+        interval=interval,
+        weekdays=','.join(d for d in WEEKDAYS if d in weekdays) if frequency == 'weekly' else None,
+        time_of_day=data['time_of_day'],
+        start_date=start_date,
+        end_date=end_date,
+        max_occurrences=max_occurrences
+    )
+    db.session.add(series)
+    db.session.flush()
+    return series
+
+
+def _add_months(day, months):
+    """Stesso giorno del mese dopo N mesi (ultimo giorno se non esiste)"""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def iter_dates(series, from_date):
+    """
+    Date locali delle occorrenze a partire da from_date (incluso)
+
+    Il primo periodo utile viene calcolato direttamente, senza ripercorrere
+    la serie dall'inizio.
+
+    Yields:
+        date: Giorni della serie in ordine crescente (sequenza illimitata)
+    """
+    start = series.start_date
+    from_date = max(from_date, start)
+    interval = series.interval or 1
+
+    if series.frequency == 'daily':
+        k = -(-(from_date - start).days // interval)
+        while True:
+            yield start + timedelta(days=k * interval)
+            k += 1
+
+    elif series.frequency == 'weekly':
+        week0 = start - timedelta(days=start.weekday())
+        days = sorted(WEEKDAYS.index(d) for d in series.weekdays.split(','))
+        k = (from_date - week0).days // 7 // interval
+        while True:
+            monday = week0 + timedelta(weeks=k * interval)
+            for weekday in days:
+                day = monday + timedelta(days=weekday)
+                if day >= from_date:
+                    yield day
+            k += 1
+
+    else:
+        months = (from_date.year - start.year) * 12 + from_date.month - start.month
+        k = max(months // interval, 0)
+        while True:
+            day = _add_months(start, k * interval)
+            if day >= from_date:
+                yield day
+            k += 1
+
+
+def occurrence_utc(series, day, rome_tz=None):
+    """
+    Orario UTC naive dell'occorrenza del giorno indicato
+
+    Al passaggio all'ora legale un orario inesistente slitta di un'ora; al
+    ritorno all'ora solare si usa la prima delle due occorrenze.
+    """
+    rome_tz = rome_tz or pytz.timezone(Config.TIMEZONE)
+    hour, minute = (int(part) for part in series.time_of_day.split(':'))
+    naive = datetime(day.year, day.month, day.day, hour, minute)
+    try:
+        local = rome_tz.localize(naive, is_dst=None)
+    except pytz.exceptions.NonExistentTimeError:
+        local = rome_tz.localize(naive + timedelta(hours=1), is_dst=True)
+    except pytz.exceptions.AmbiguousTimeError:
+        local = rome_tz.localize(naive, is_dst=True)
+    return local.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def expand_series(series, until, now=None):
+    """
+    Crea i post della serie fino a until e li salva (commit)
+
+    L'intervallo viene prenotato con un UPDATE condizionale su expanded_until:
+    due processi che espandono la stessa serie non creano doppioni. Le
+    occorrenze già passate (es. cron fermo) non vengono create.
+
+    Args:
+        series (PostSeries): Serie attiva
+        until (datetime): Fine finestra UTC naive
+        now (datetime): Istante corrente UTC naive
+
+    Returns:
+        int: Post creati
+    """
+    now = now or datetime.utcnow()
+    previous = series.expanded_until
+    if previous is not None and previous >= until:
+        return 0
+
+    claim = PostSeries.query.filter(PostSeries.id == series.id, PostSeries.is_active.is_(True))
+    claim = claim.filter(PostSeries.expanded_until == previous) if previous is not None \
+        else claim.filter(PostSeries.expanded_until.is_(None))
+    if not claim.update({'expanded_until': until}, synchronize_session=False):
+        db.session.rollback()
+        return 0
+
+    rome_tz = pytz.timezone(Config.TIMEZONE)
+    lower = max(previous or now, now)
+    from_date = pytz.UTC.localize(lower).astimezone(rome_tz).date()
+
+    created = 0
+    finished = False
+    for day in iter_dates(series, from_date):
+        if series.end_date and day > series.end_date:
+            finished = True
+            break
+        if series.max_occurrences and series.occurrences_created + created >= series.max_occurrences:
+            finished = True
+            break
+        when = occurrence_utc(series, day, rome_tz)
+        if when > until:
+            break
+        if when <= lower:
+            continue
+        # Nessun controllo anti-duplicato: le occorrenze ripetono lo stesso
+        # testo per definizione e verrebbero segnalate l'una contro l'altra
+        post = Post(
+            content=series.content,
+            platforms=series.platforms,
+            image_url=series.image_url,
+            video_url=series.video_url,
+            scheduled_date=when,
+            status='scheduled',
+            pinterest_board_id=series.pinterest_board_id,
+            pinterest_link=series.pinterest_link,
+            template_name=series.template_name,
+            notes=series.notes
+        )
+        post.series_link = SeriesPost(series_id=series.id, occurs_at=when)
+        db.session.add(post)
+        created += 1
+
+    PostSeries.query.filter_by(id=series.id).update({
+        'occurrences_created': PostSeries.occurrences_created + created,
+        'is_active': not finished
+    }, synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(series)
+    return created
+
+
+def expand_all(window_days=None, now=None):
+    """
+    Espande tutte le serie attive fino a now + window_days
+
+    Returns:
+        int: Post creati in totale
+    """
+    now = now or datetime.utcnow()
+    until = now + timedelta(days=window_days or Config.SERIES_WINDOW_DAYS)
+    pending = PostSeries.query.filter(
+        PostSeries.is_active.is_(True),
+        db.or_(PostSeries.expanded_until.is_(None), PostSeries.expanded_until < until)
+    ).all()
+
+    total = 0
+    for series in pending:
+        try:
+            total += expand_series(series, until, now)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Espansione serie {series.id} fallita: {e}")
+    return total
+
+
+def stop_series(series):
+    """
+    Disattiva la serie (senza commit)
+
+    Returns:
+        list: ID dei post futuri ancora da pubblicare, da eliminare a parte
+    """
+    series.is_active = False
+    return [post_id for post_id, in db.session.query(SeriesPost.post_id)
+            .join(Post, Post.id == SeriesPost.post_id)
+            .filter(SeriesPost.series_id == series.id,
+                    Post.status == 'scheduled',
+                    Post.scheduled_date > datetime.utcnow())]
+
+
+@click.command('series-expand')
+@click.option('--days', type=int, help='Giorni della finestra (default SERIES_WINDOW_DAYS)')
+@with_appcontext
+def series_command(days):
+    """Crea i post delle serie ricorrenti per la finestra mobile"""
+    created = expand_all(window_days=days)
+    click.echo(f"✅ {created} post creati dalle serie ricorrenti")
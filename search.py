@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Ricerca full-text sui post con SQLite FTS5
+Labirintoambientale.it
+
+L'indice posts_fts è una tabella FTS5 "external content" su posts
+(content, notes, template_name): non duplica il testo e viene tenuta
+allineata da trigger SQLite, quindi qualsiasi scrittura sui post (app,
+cron, azioni massive) aggiorna l'indice senza codice applicativo.
+"""
+from sqlalchemy import column, func, table, text
+from sqlalchemy.exc import OperationalError
+
+from models import db, Post
+from post_filters import FilterError, apply_post_filters
+
+# Tabella virtuale fuori dai metadata: db.create_all() non la tocca
+posts_fts = table('posts_fts', column('rowid'), column('content'),
+                  column('notes'), column('template_name'))
+
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        content, notes, template_name,
+        content='posts', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ai AFTER INSERT ON posts BEGIN
+        INSERT INTO posts_fts(rowid, content, notes, template_name)
+        VALUES (new.id, new.content, new.notes, new.template_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_ad AFTER DELETE ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, content, notes, template_name)
+        VALUES ('delete', old.id, old.content, old.notes, old.template_name);
+    END""",
+    # Solo le colonne indicizzate: i cambi di stato non toccano l'indice
+    """CREATE TRIGGER IF NOT EXISTS posts_fts_au AFTER UPDATE OF content, notes, template_name ON posts BEGIN
+        INSERT INTO posts_fts(posts_fts, rowid, content, notes, template_name)
+        VALUES ('delete', old.id, old.content, old.notes, old.template_name);
+        INSERT INTO posts_fts(rowid, content, notes, template_name)
+        VALUES (new.id, new.content, new.notes, new.template_name);
+    END""",
+]
+
+
+class SearchError(FilterError):
+    """Parametri di ricerca non validi"""
+
+
+class SearchUnavailableError(Exception):
+    """Indice full-text assente (init-db non eseguito) o FTS5 non supportato"""
+
+
+def create_index():
+    """
+    Crea indice FTS5 e trigger se mancanti e indicizza i post esistenti
+
+    Returns:
+        bool: True se la ricerca full-text è disponibile
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with db.engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'posts_fts'"
+            )).first()
+            for statement in FTS_SCHEMA:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text("INSERT INTO posts_fts(posts_fts) VALUES ('rebuild')"))
+    except OperationalError as e:
+        # SQLite compilato senza FTS5
+        print(f"⚠️  Ricerca full-text non disponibile: {e}")
+        return False
+    return True
+
+
+def build_match_query(raw_query):
+    """
+    Converte il testo utente in una query FTS5 sicura
+
+    Ogni parola diventa una frase tra virgolette (niente operatori FTS5
+    involontari, es. 'codice-CER'); l'ultima è un prefisso, per la ricerca
+    mentre si digita.
+    """
+    terms = [t.replace('"', '""') for t in (raw_query or '').split() if t.strip('"')]
+    if not terms:
+        raise SearchError('Testo di ricerca mancante')
+    quoted = [f'"{t}"' for t in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_posts(raw_query, status=None, platform=None, date_from=None, date_to=None,
+                 page=1, per_page=20):
+    """
+    Ricerca post per rilevanza (BM25) con filtri opzionali
+
+    Args:
+        raw_query (str): Testo cercato
+        status (str): Filtra per stato
+        platform (str): Filtra per piattaforma
+        date_from (str): Dal giorno YYYY-MM-DD (ora di Roma, scheduled_date)
+        date_to (str): Al giorno YYYY-MM-DD incluso
+        page (int): Pagina (da 1)
+        per_page (int): Risultati per pagina (max 100)
+
+    Returns:
+        dict: {'results': [...], 'page', 'per_page', 'has_next'}
+
+    Raises:
+        SearchUnavailableError: Tabella posts_fts assente
+    """
+    match = build_match_query(raw_query)
+    page = max(int(page), 1)
+    per_page = min(max(int(per_page), 1), 100)
+
+    rank = func.bm25(text('posts_fts')).label('rank')
+    snippet = func.snippet(text('posts_fts'), 0, '[', ']', '…', 16).label('snippet')
+    query = db.session.query(Post, rank, snippet) \
+        .join(posts_fts, posts_fts.c.rowid == Post.id) \
+        .filter(text('posts_fts MATCH :match').bindparams(match=match))
+
+    query = apply_post_filters(query, {'status': status, 'platform': platform,
+                                       'date_from': date_from, 'date_to': date_to})
+
+    # Un risultato in più per sapere se esiste la pagina successiva senza COUNT(*)
+    try:
+        rows = query.order_by(rank).offset((page - 1) * per_page).limit(per_page + 1).all()
+    except OperationalError as e:
+        db.session.rollback()
+        if 'posts_fts' not in str(e) and 'fts5' not in str(e):
+            raise
+        raise SearchUnavailableError(
+            'Indice di ricerca non disponibile: eseguire `flask --app app init-db`')
+
+    results = []
+    for post, score, snip in rows[:per_page]:
+        item = post.to_dict()
+        item['score'] = -score  # bm25() è negativo: più basso = più rilevante
+        item['snippet'] = snip
+        results.append(item)
+
+    return {
+        'results': results,
+        'page': page,
+        'per_page': per_page,
+        'has_next': len(rows) > per_page
+    }
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Assegnazione automatica degli orari di pubblicazione
+Labirintoambientale.it
+
+Gli orari candidati sono quelli di Config.OPTIMAL_POSTING_TIMES (ora di
+Roma, convertiti in UTC giorno per giorno, quindi corretti anche a cavallo
+del cambio ora legale). L'occupazione è indicizzata per piattaforma in
+liste ordinate di orari già programmati: verificare la distanza minima da
+un orario richiede una ricerca binaria, non una scansione dei post.
+"""
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+import pytz
+
+from config import Config
+from models import db, Post
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+class SlotBook:
+    """Orari occupati per piattaforma (UTC naive, liste ordinate)"""
+
+    def __init__(self, spacing_minutes=None):
+        spacing_minutes = spacing_minutes if spacing_minutes is not None \
+            else Config.MIN_POST_SPACING_MINUTES
+        self.spacing = {platform: timedelta(minutes=minutes)
+                        for platform, minutes in spacing_minutes.items()}
+        self._taken = {}
+
+    def max_spacing(self):
+        return max(self.spacing.values(), default=timedelta(0))
+
+    def load(self, start, end, exclude_ids=()):
+        """
+        Carica i post programmati tra start ed end (una sola query)
+
+        Args:
+            start (datetime): Inizio finestra (UTC naive)
+            end (datetime): Fine finestra (UTC naive)
+            exclude_ids (iterable): Post da ignorare (quelli da riassegnare)
+        """
+        margin = self.max_spacing()
+        query = db.session.query(Post.scheduled_date, Post.platforms).filter(
+            Post.status == 'scheduled',
+            Post.scheduled_date >= start - margin,
+            Post.scheduled_date <= end + margin
+        )
+        exclude_ids = list(exclude_ids)
+        if exclude_ids:
+            query = query.filter(Post.id.notin_(exclude_ids))
+        for scheduled_date, platforms in query:
+            self.book(_split_platforms(platforms), scheduled_date)
+
+    def is_free(self, platforms, when):
+        """True se nessuna piattaforma ha un post più vicino della distanza minima"""
+        for platform in platforms:
+            taken = self._taken.get(platform)
+            if not taken:
+                continue
+            # Un orario identico è sempre occupato, anche con distanza 0
+            spacing = max(self.spacing.get(platform, timedelta(0)), timedelta(seconds=1))
+            i = bisect_left(taken, when)
+            if i < len(taken) and taken[i] - when < spacing:
+                return False
+            if i > 0 and when - taken[i - 1] < spacing:
+                return False
+        return True
+
+    def book(self, platforms, when):
+        """Segna l'orario come occupato per le piattaforme indicate"""
+        for platform in platforms:
+            insort(self._taken.setdefault(platform, []), when)
+
+
+def _split_platforms(platforms):
+    return [p.strip() for p in (platforms or '').split(',') if p.strip()]
+
+
+def _localize(rome_tz, naive):
+    """Localizza un orario di Roma; None se non esiste (salto ora legale)"""
+    try:
+        return rome_tz.localize(naive, is_dst=None)
+    except pytz.exceptions.NonExistentTimeError:
+        return None
+    except pytz.exceptions.AmbiguousTimeError:
+        # Ritorno all'ora solare: si usa la prima delle due occorrenze
+        return rome_tz.localize(naive, is_dst=True)
+
+
+def iter_optimal_slots(start, days, posting_times=None):
+    """
+    Orari ottimali in UTC a partire da start
+
+    Args:
+        start (datetime): Primo istante utile (UTC naive, escluso)
+        days (int): Giorni da considerare
+        posting_times (dict): giorno della settimana -> ['HH:MM', ...]
+
+    Yields:
+        datetime: Orari UTC naive in ordine crescente
+    """
+    posting_times = posting_times or Config.OPTIMAL_POSTING_TIMES
+    rome_tz = pytz.timezone(Config.TIMEZONE)
+    first_day = pytz.UTC.localize(start).astimezone(rome_tz).date()
+
+    for offset in range(days + 1):
+        day = first_day + timedelta(days=offset)
+        for hhmm in sorted(posting_times.get(WEEKDAYS[day.weekday()], [])):
+            hour, minute = (int(part) for part in hhmm.split(':'))
+            local = _localize(rome_tz, datetime(day.year, day.month, day.day, hour, minute))
+            if local is None:
+                continue
+            slot = local.astimezone(pytz.UTC).replace(tzinfo=None)
+            if slot > start:
+                yield slot
+
+
+def allocate(posts, start=None, horizon_days=None, spacing_minutes=None):
+    """
+    Assegna a ogni post il primo orario ottimale libero per tutte le sue piattaforme
+
+    I post vengono assegnati nell'ordine ricevuto; gli orari già occupati
+    (post programmati non inclusi nel lotto) e quelli assegnati nel lotto
+    rispettano la distanza minima per piattaforma.
+
+    Args:
+        posts (list): Post da programmare
+        start (datetime): Primo istante utile UTC naive (default adesso)
+        horizon_days (int): Giorni massimi in avanti
+        spacing_minutes (dict): Distanza minima per piattaforma in minuti
+
+    Returns:
+        dict: {post_id: datetime UTC naive}; i post senza orario libero
+            nell'orizzonte non compaiono
+    """
+    now = datetime.utcnow()
+    start = max(start or now, now)
+    horizon_days = horizon_days or Config.AUTO_SCHEDULE_HORIZON_DAYS
+
+    slots = list(iter_optimal_slots(start, horizon_days))
+    book = SlotBook(spacing_minutes)
+    if slots:
+        book.load(slots[0], slots[-1], exclude_ids=[post.id for post in posts])
+
+    # Per ogni combinazione di piattaforme, gli slot precedenti all'ultimo
+    # assegnato restano occupati: la ricerca riparte da lì
+    cursors = {}
+    assignments = {}
+    for post in posts:
+        platforms = _split_platforms(post.platforms)
+        key = frozenset(platforms)
+        for i in range(cursors.get(key, 0), len(slots)):
+            if book.is_free(platforms, slots[i]):
+                book.book(platforms, slots[i])
+                assignments[post.id] = slots[i]
+                cursors[key] = i
+                break
+        else:
+            cursors[key] = len(slots)
+    return assignments
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Fixture comuni dei test
+Labirintoambientale.it
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from factory import create_db_app, init_schema  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App con database e directory di lavoro temporanei"""
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'posts.db')
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        CACHE_DIR = str(tmp_path / 'cache')
+        METRICS_DIR = str(tmp_path / 'metrics')
+        LATE_HANDOFF = False
+
+    app = create_db_app(TestConfig)
+    with app.app_context():
+        init_schema()
+        yield app
+        db.session.remove()
+
+
+class FakeLateAPI:
+    """Client LATE finto: registra le chiamate e risponde con successo"""
+
+    def __init__(self):
+        self.calls = []
+
+    def create_post(self, **kwargs):
+        self.calls.append(kwargs)
+        return {'success': True, 'data': {'id': f'late-{len(self.calls)}'}}
+
+
+@pytest.fixture
+def late_api():
+    return FakeLateAPI()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Test degli account social salvati da Impostazioni
+Labirintoambientale.it
+"""
+import accounts
+from config import Config
+from models import db, AccountSettings
+
+
+def _form(**overrides):
+    """Valori inviati dal form così come li mostra la pagina"""
+    data = {platform: {'account_id': account['account_id'], 'is_active': account['is_active'],
+                       'pinterest_default_board': account['pinterest_default_board']}
+            for platform, account in accounts.get_accounts().items()}
+    for platform, values in overrides.items():
+        data[platform].update(values)
+    return data
+
+
+def test_unchanged_config_accounts_are_not_copied(app, monkeypatch):
+    monkeypatch.setitem(Config.SOCIAL_ACCOUNTS, 'facebook', 'fb-env')
+    monkeypatch.setattr(Config, 'PINTEREST_DEFAULT_BOARD', 'board-env')
+    accounts.registry.invalidate()
+
+    assert accounts.save_accounts(_form()) == 0
+    db.session.commit()
+    assert AccountSettings.query.count() == 0
+
+    # Il cambio della variabile d'ambiente vale ancora
+    monkeypatch.setitem(Config.SOCIAL_ACCOUNTS, 'facebook', 'fb-env-2')
+    accounts.registry.invalidate()
+    assert accounts.get_account('facebook')['account_id'] == 'fb-env-2'
+
+    assert accounts.save_accounts(_form(facebook={'is_active': False},
+                                        linkedin={'account_id': 'li-db', 'is_active': True})) == 2
+    db.session.commit()
+    assert {row.platform for row in AccountSettings.query} == {'facebook', 'linkedin'}
+    assert accounts.get_account('facebook') is None
+    assert accounts.get_account('linkedin')['account_id'] == 'li-db'
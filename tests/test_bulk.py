@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Test delle azioni massive sui post
+Labirintoambientale.it
+"""
+from datetime import datetime, timedelta
+
+import bulk
+import outbox
+from models import db, Post, Delivery, AccountSettings
+
+
+def _post_in_retry(now, status='scheduled'):
+    """Post scaduto con una consegna twitter in attesa del secondo tentativo"""
+    db.session.add(AccountSettings(platform='twitter', account_id='tw', is_active=True))
+    post = Post(content='Giornata del verde urbano', platforms='twitter',
+                scheduled_date=now - timedelta(minutes=5), status=status)
+    db.session.add(post)
+    db.session.flush()
+    db.session.add(Delivery(post_id=post.id, platform='twitter', status='pending', attempts=1,
+                            max_attempts=5, next_attempt_at=now + timedelta(minutes=1),
+                            last_error='503 Service Unavailable'))
+    db.session.commit()
+    return post
+
+
+def test_reschedule_moves_pending_retry_to_new_date(app, late_api):
+    now = datetime.utcnow()
+    post = _post_in_retry(now)
+
+    summary, futures = bulk.run_bulk_action('reschedule', {'ids': [post.id]}, late_api,
+                                            scheduled_date='2030-05-01 10:00')
+    assert summary['affected'] == 1
+    assert futures == []
+
+    # Il vecchio orario di backoff non vale più
+    assert outbox.drain(late_api, now=now + timedelta(minutes=2)) == (0, 0)
+    assert late_api.calls == []
+
+    delivery = Delivery.query.filter_by(post_id=post.id).one()
+    assert delivery.status == 'pending'
+    assert delivery.attempts == 0
+    # 10:00 a Roma (ora legale) = 08:00 UTC
+    assert delivery.next_attempt_at == datetime(2030, 5, 1, 8, 0)
+
+    assert outbox.drain(late_api, now=datetime(2030, 5, 1, 8, 1)) == (1, 0)
+    assert db.session.get(Post, post.id).status == 'published'
+
+
+def test_reschedule_keeps_drafts_as_drafts(app, late_api):
+    draft = Post(content='Bozza', platforms='twitter',
+                 scheduled_date=datetime.utcnow(), status='draft')
+    db.session.add(draft)
+    db.session.commit()
+
+    bulk.run_bulk_action('reschedule', {'ids': [draft.id]}, late_api, shift_minutes=60)
+    bulk.run_bulk_action('autoschedule', {'ids': [draft.id]}, late_api)
+
+    assert db.session.get(Post, draft.id).status == 'draft'
+    assert outbox.enqueue_due_posts(now=datetime(2031, 1, 1)) == 0
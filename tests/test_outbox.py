@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Test dell'outbox delle consegne
+Labirintoambientale.it
+"""
+from datetime import datetime, timedelta
+
+import outbox
+from models import db, Post, Delivery, AccountSettings
+
+
+def test_edited_post_moves_retries_and_enqueues_new_platforms(app, late_api):
+    now = datetime.utcnow()
+    for platform in ('twitter', 'facebook', 'linkedin'):
+        db.session.add(AccountSettings(platform=platform, account_id=platform, is_active=True))
+    post = Post(content='Pulizia del parco', platforms='twitter,facebook',
+                scheduled_date=now - timedelta(minutes=5), status='scheduled')
+    db.session.add(post)
+    db.session.flush()
+    for platform in ('twitter', 'facebook'):
+        db.session.add(Delivery(post_id=post.id, platform=platform, status='pending', attempts=1,
+                                max_attempts=5, next_attempt_at=now + timedelta(minutes=1)))
+    db.session.commit()
+
+    # Modifica: via facebook, aggiunto linkedin, data spostata di un giorno
+    new_date = now + timedelta(days=1)
+    post.platforms = 'twitter,linkedin'
+    post.scheduled_date = new_date
+    assert outbox.update_edited_post(post, date_changed=True) == 1
+    db.session.commit()
+
+    deliveries = {d.platform: d for d in Delivery.query.filter_by(post_id=post.id)}
+    assert set(deliveries) == {'twitter', 'linkedin'}
+    assert all(d.next_attempt_at == new_date for d in deliveries.values())
+
+    assert outbox.drain(late_api, now=now + timedelta(minutes=2)) == (0, 0)
+    assert outbox.drain(late_api, now=new_date) == (2, 0)
+    assert sorted(call['platforms'][0] for call in late_api.calls) == ['linkedin', 'twitter']
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Ricezione delle callback di stato LATE
+Labirintoambientale.it
+
+L'endpoint verifica la firma HMAC, salva l'evento in webhook_events e
+risponde subito. Gli eventi in coda vengono applicati a Delivery, Post e
+PublicationLog a lotti, in una transazione per lotto: da un timer in
+background pochi istanti dopo la ricezione e, come rete di sicurezza, dallo
+script cron.
+"""
+import hashlib
+import hmac
+import json
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Delivery, WebhookEvent
+from config import Config
+import outbox
+
+# Attesa prima di elaborare, per raccogliere più eventi in un solo lotto
+BATCH_DELAY = 1.0
+
+_flush_lock = threading.Lock()
+_flush_scheduled = False
+
+
+def verify_signature(body, signature, secret):
+    """
+    Verifica la firma HMAC-SHA256 del corpo della richiesta
+
+    Args:
+        body (bytes): Corpo grezzo della richiesta
+        signature (str): Valore dell'header firma (hex, opzionale prefisso 'sha256=')
+        secret (str): Segreto condiviso configurato su LATE
+
+    Returns:
+        bool: True se la firma è valida
+    """
+    if not secret or not signature:
+        return False
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.strip().lower())
+
+
+def store_event(payload):
+    """
+    Salva un evento in coda (con commit)
+
+    Returns:
+        tuple: (evento, created) - created è False per un evento già ricevuto
+    """
+    event_id = payload.get('id') or payload.get('eventId')
+    event = WebhookEvent(
+        event_id=str(event_id) if event_id else None,
+        event_type=payload.get('event') or payload.get('type'),
+        payload=json.dumps(payload),
+        status='queued'
+    )
+    db.session.add(event)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # LATE ritenta le consegne: lo stesso evento può arrivare più volte
+        db.session.rollback()
+        return WebhookEvent.query.filter_by(event_id=str(event_id)).first(), False
+    return event, True
+
+
+def _remote_post(payload):
+    """Estrae l'oggetto post dal payload della callback"""
+    data = payload.get('data', payload)
+    if isinstance(data, dict) and isinstance(data.get('post'), dict):
+        return data['post']
+    return data if isinstance(data, dict) else {}
+
+
+def _claim_batch(batch_size):
+    """Riserva atomicamente un lotto di eventi in coda per questo processo"""
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=Config.OUTBOX_LEASE_SECONDS)
+    candidates = db.session.query(WebhookEvent.id).filter(
+        (WebhookEvent.status == 'queued') |
+        ((WebhookEvent.status == 'processing') & (WebhookEvent.claimed_at < lease_expired))
+    ).order_by(WebhookEvent.id.asc()).limit(batch_size).subquery()
+    WebhookEvent.query.filter(
+        WebhookEvent.id.in_(db.select(candidates.c.id)),
+        WebhookEvent.status.in_(('queued', 'processing'))
+    ).update({'status': 'processing', 'batch_token': token, 'claimed_at': now},
+             synchronize_session=False)
+    db.session.commit()
+    return WebhookEvent.query.filter_by(batch_token=token, status='processing') \
+        .order_by(WebhookEvent.id.asc()).all()
+
+
+def process_pending(batch_size=None):
+    """
+    Applica gli eventi in coda a lotti, una transazione per lotto
+
+    Returns:
+        int: Numero di eventi elaborati
+    """
+    batch_size = batch_size or Config.OUTBOX_BATCH_SIZE
+    processed = 0
+
+    while True:
+        events = _claim_batch(batch_size)
+        if not events:
+            break
+
+        # Un'unica query per tutte le consegne citate nel lotto
+        remotes = {}
+        for event in events:
+            try:
+                remote = _remote_post(json.loads(event.payload))
+            except ValueError:
+                remote = {}
+            remotes[event.id] = remote
+        remote_ids = {outbox.remote_post_id(r) for r in remotes.values()} - {None}
+        deliveries = {}
+        if remote_ids:
+            for delivery in Delivery.query.filter(Delivery.late_post_id.in_(remote_ids)):
+                deliveries.setdefault(delivery.late_post_id, []).append(delivery)
+
+        touched_posts = set()
+        now = datetime.utcnow()
+        for event in events:
+            remote = remotes[event.id]
+            applied = False
+            for delivery in deliveries.get(outbox.remote_post_id(remote), []):
+                # Hand-off in attesa di esito e invii immediati non ancora
+                # smentiti; gli eventi ripetuti non cambiano nulla
+                if outbox.apply_callback(delivery, remote):
+                    touched_posts.add(delivery.post)
+                    applied = True
+            event.status = 'processed' if applied else 'ignored'
+            event.processed_at = now
+
+        for post in touched_posts:
+            outbox.update_post_status(post)
+        db.session.commit()
+        processed += len(events)
+
+    return processed
+
+
+def schedule_flush(app):
+    """
+    Pianifica un'elaborazione della coda dopo BATCH_DELAY (una sola alla volta per processo)
+
+    L'attesa avviene su un timer dedicato e non nel pool dei job: una raffica
+    di callback non occupa i thread di pubblicazione immediata e hand-off.
+    """
+    global _flush_scheduled
+    with _flush_lock:
+        if _flush_scheduled:
+            return
+        _flush_scheduled = True
+    timer = threading.Timer(BATCH_DELAY, _flush, args=(app,))
+    timer.daemon = True
+    timer.start()
+
+
+def _flush(app):
+    global _flush_scheduled
+    with _flush_lock:
+        _flush_scheduled = False
+    with app.app_context():
+        try:
+            process_pending()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Eccezione durante elaborazione webhook: {e}")